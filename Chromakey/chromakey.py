@@ -1,7 +1,19 @@
 import argparse
-from PIL import Image
+import re
+from PIL import Image, ImageChops, ImageMath
 import numpy as np
 import os
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; chroma_key falls back to plain numpy
+    njit = None
+    prange = range
+
+_HEX_RE = re.compile(r'^[0-9a-fA-F]{6}$')
+# Below this many pixels chroma_key stays in Pillow instead of going through numpy
+_SMALL_IMAGE_PIXELS = 200_000
+# Image.Resampling on Pillow 9.1+, the old module-level constants before that
+_BILINEAR = getattr(Image, 'Resampling', Image).BILINEAR
 
 
 def parse_args():
@@ -13,8 +25,10 @@ def parse_args():
     parser.add_argument('--foreground', required=True, help="Path to the foreground image (PNG/JPG)")
     parser.add_argument('--background', required=True, help="Path to the background image (PNG/JPG)")
     parser.add_argument('--keycolor', required=True, help="Target key color as hex (e.g., #00FF00 for green)")
-    parser.add_argument('--tolerance', type=int, default=30, help="Tolerance for color similarity (default: 30)")
+    parser.add_argument('--tolerance', type=int, default=200,
+                        help="Max RGB distance from the key color (default: 200, suits #00FF00 on a real green screen)")
     parser.add_argument('--output', required=True, help="Path to save the output image")
+    parser.add_argument('--verbose', action='store_true', help="Report the number of masked pixels")
     return parser.parse_args()
 
 
@@ -25,7 +39,30 @@ def hex_to_rgb(hexcolor):
     :return:
     """
     hexcolor = hexcolor.lstrip('#')
-    return tuple(int(hexcolor[i:i+2], 16) for i in (0, 2, 4))
+    if not _HEX_RE.match(hexcolor):
+        raise ValueError("Invalid hex color format. Use RRGGBB or #RRGGBB.")
+    value = int(hexcolor, 16)
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+
+def _resize(img, size):
+    """
+    Bilinear resize. When an axis shrinks by 2x or more, Image.reduce first drops it by the whole factor
+    (a cheap box filter) so the bilinear pass only covers what is left.
+    :param img:
+    :param size: target (width, height)
+    :return:
+    """
+    factor_x = max(1, img.size[0] // size[0])
+    factor_y = max(1, img.size[1] // size[1])
+    if factor_x > 1 or factor_y > 1:
+        try:
+            img = img.reduce((factor_x, factor_y))
+        except ValueError:
+            pass  # reduce() doesn't take palette/bilevel/16-bit modes; plain resize handles them
+    if img.size == size:
+        return img
+    return img.resize(size, _BILINEAR)
 
 
 def resize_to_match(img1, img2):
@@ -39,47 +76,195 @@ def resize_to_match(img1, img2):
         return img1, img2
     # Resize smaller image to match larger one
     if img1.size[0] * img1.size[1] > img2.size[0] * img2.size[1]:
-        img2 = img2.resize(img1.size, Image.BILINEAR)
+        img2 = _resize(img2, img1.size)
     else:
-        img1 = img1.resize(img2.size, Image.BILINEAR)
+        img1 = _resize(img1, img2.size)
     return img1, img2
 
 
-def chroma_key(fg, bg, keycolor, tolerance, white_protect=180):
+def _as_rgba(img):
+    """
+    Return the image in RGBA mode, skipping the full-image copy convert() makes when it already is.
+    :param img:
+    :return:
+    """
+    return img if img.mode == 'RGBA' else img.convert('RGBA')
+
+
+def _rgba_array(img):
+    """
+    Read-only (H, W, 4) uint8 view of an image's RGBA pixels, wrapped straight from tobytes() without another copy.
+    :param img:
+    :return:
+    """
+    img = _as_rgba(img)
+    width, height = img.size
+    return np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(height, width, 4)
+
+
+def _chroma_fuse(fg, bg, r, g, b, tol2, dom_idx, o1, o2, white_protect, out):
+    """
+    Fused chroma key kernel: walks every pixel once and writes either the foreground or background RGBA into out.
+    Same mask as the numpy path in chroma_key, without any of the full-size temporary arrays.
+    :param fg: contiguous uint8 RGBA foreground array
+    :param bg: contiguous uint8 RGBA background array
+    :param r: key color red
+    :param g: key color green
+    :param b: key color blue
+    :param tol2: squared tolerance
+    :param dom_idx: dominant channel of the key color
+    :param o1: first of the other two channels
+    :param o2: second of the other two channels
+    :param white_protect: threshould of "whitish" colors to leave alone
+    :param out: uint8 RGBA output array, same shape as fg
+    :return: number of pixels taken from the background
+    """
+    height, width = fg.shape[0], fg.shape[1]
+    bright = 3 * white_protect
+    masked = 0
+    for y in prange(height):
+        for x in range(width):
+            fr = int(fg[y, x, 0])
+            fgr = int(fg[y, x, 1])
+            fb = int(fg[y, x, 2])
+            dr = fr - r
+            dg = fgr - g
+            db = fb - b
+            dom = int(fg[y, x, dom_idx])
+            # Close to key color, dominantly that color, and NOT very bright (sum of RGB vs 3x the average)
+            keyed = (dr * dr + dg * dg + db * db < tol2 and
+                     dom > int(fg[y, x, o1]) + 10 and
+                     dom > int(fg[y, x, o2]) + 10 and
+                     fr + fgr + fb <= bright)
+            if keyed:
+                masked += 1
+                for c in range(4):
+                    out[y, x, c] = bg[y, x, c]
+            else:
+                for c in range(4):
+                    out[y, x, c] = fg[y, x, c]
+    return masked
+
+
+if njit is not None:
+    _chroma_fuse = njit(parallel=True, fastmath=True, cache=True)(_chroma_fuse)
+
+
+def _key_mask(fg_data, r, g, b, tolerance, dom_idx, o1, o2, white_protect):
+    """
+    Numpy chroma key mask. A pixel can only be within tolerance of the key if every channel is, so a cheap
+    per-channel range check on the raw uint8 data picks the candidates and only those get the full
+    squared-distance, dominance and brightness tests.
+    :param fg_data: (H, W, 4) uint8 foreground array
+    :param r:
+    :param g:
+    :param b:
+    :param tolerance:
+    :param dom_idx: dominant channel of the key color
+    :param o1: first of the other two channels
+    :param o2: second of the other two channels
+    :param white_protect:
+    :return: (H, W) bool mask of pixels to take from the background
+    """
+    height, width = fg_data.shape[0], fg_data.shape[1]
+    candidates = np.ones((height, width), dtype=bool)
+    for channel, key in enumerate((r, g, b)):
+        candidates &= (fg_data[:, :, channel] > key - tolerance) & (fg_data[:, :, channel] < key + tolerance)
+    idx = np.flatnonzero(candidates)
+    px = fg_data.reshape(-1, 4)[idx, :3]
+    # Squared distance avoids a per-pixel sqrt; differences go straight into int32 buffers so the uint8
+    # channels never wrap and no upcast temporaries are made
+    diff2 = np.zeros(idx.size, dtype=np.int32)
+    tmp = np.empty(idx.size, dtype=np.int32)
+    for channel, key in enumerate((r, g, b)):
+        np.subtract(px[:, channel], key, out=tmp, dtype=np.int32)
+        np.multiply(tmp, tmp, out=tmp)
+        np.add(diff2, tmp, out=diff2)
+    keep = diff2 < tolerance * tolerance
+    # Color dominance check
+    for other in (o1, o2):
+        np.subtract(px[:, dom_idx], px[:, other], out=tmp, dtype=np.int32)
+        keep &= tmp > 10
+    # Luma (brightness) – simple average, compared as R+G+B against 3x the threshold to stay in integers
+    np.add(px[:, 0], px[:, 1], out=tmp, dtype=np.int32)
+    np.add(tmp, px[:, 2], out=tmp)
+    keep &= tmp <= 3 * white_protect
+    # Final mask: pixel must be close to key color, dominantly that color, and NOT very bright
+    mask = np.zeros(height * width, dtype=bool)
+    mask[idx[keep]] = True
+    return mask.reshape(height, width)
+
+
+def _key_mask_pil(fg, r, g, b, tolerance, dom_idx, o1, o2, white_protect):
+    """
+    Pillow-only chroma key mask for small images, where setting up numpy arrays costs more than the pixel work.
+    Same tests as _key_mask, evaluated by libImaging on 32-bit ImageMath images.
+    :param fg:
+    :param r:
+    :param g:
+    :param b:
+    :param tolerance:
+    :param dom_idx: dominant channel of the key color
+    :param o1: first of the other two channels
+    :param o2: second of the other two channels
+    :param white_protect:
+    :return: 'L' mask, 255 where the background shows through
+    """
+    rgb = fg if fg.mode == "RGB" else fg.convert("RGB")
+    dr, dg, db = ImageChops.difference(rgb, Image.new("RGB", rgb.size, (r, g, b))).split()
+    channels = rgb.split()
+    tol2 = tolerance * tolerance
+    bright = 3 * white_protect
+    mask = ImageMath.lambda_eval(
+        lambda a: (((a['dr'] * a['dr'] + a['dg'] * a['dg'] + a['db'] * a['db']) < tol2) &
+                   (a['dom'] > a['o1'] + 10) & (a['dom'] > a['o2'] + 10) &
+                   (a['r'] + a['g'] + a['b'] <= bright)) * 255,
+        dr=dr, dg=dg, db=db, dom=channels[dom_idx], o1=channels[o1], o2=channels[o2],
+        r=channels[0], g=channels[1], b=channels[2])
+    return mask.convert("L")
+
+
+def chroma_key(fg, bg, keycolor, tolerance, white_protect=180, verbose=False):
     """
     Perform chroma key compositing on the foreground image using the specified key color and background image.
     :param fg: image with the "green" for masking
     :param bg: image that will be laid into the mask color area
     :param keycolor: target color to mask out (as RGB tuple)
-    :param tolerance: tolerance figure for color similarity (default: 30)
+    :param tolerance: max RGB distance from the key color
     :param white_protect: threshould of "whitish" colors to mask out (lighting, glares) (255 = absolute white)
+    :param verbose: print the number of masked pixels (costs a full pass over the mask on the numpy path)
     :return:
     """
-    fg_data = np.array(fg.convert("RGBA"))
-    bg_data = np.array(bg.convert("RGBA"))
     r, g, b = keycolor
-    diff = np.sqrt(
-        (fg_data[:, :, 0] - r) ** 2 +
-        (fg_data[:, :, 1] - g) ** 2 +
-        (fg_data[:, :, 2] - b) ** 2
-    )
     # Determine dominant channel in key color
     key_rgb = np.array([r, g, b])
-    dominant_channel = np.argmax(key_rgb)
+    dominant_channel = int(np.argmax(key_rgb))
     other_channels = [i for i in range(3) if i != dominant_channel]
-    # Color dominance check
-    pixel_dominant = (
-        (fg_data[:, :, dominant_channel] > fg_data[:, :, other_channels[0]] + 10) &
-        (fg_data[:, :, dominant_channel] > fg_data[:, :, other_channels[1]] + 10)
-    )
-    # Luma (brightness) – using simple average, or you can do weighted: 0.299*R + 0.587*G + 0.114*B
-    luma = fg_data[:, :, :3].mean(axis=2)
-    is_bright = luma > white_protect
-    # Final mask: pixel must be close to key color, dominantly that color, and NOT very bright
-    mask = (diff < tolerance) & pixel_dominant & (~is_bright)
-    print(f"Masked pixels: {np.sum(mask)}")
-    output = np.where(mask[:, :, None], bg_data, fg_data)
-    return Image.fromarray(output, 'RGBA')
+    if fg.size[0] * fg.size[1] < _SMALL_IMAGE_PIXELS and hasattr(ImageMath, 'lambda_eval'):
+        # Small image: Pillow's own channel ops beat the numpy round-trip
+        mask = _key_mask_pil(fg, r, g, b, tolerance, dominant_channel,
+                             other_channels[0], other_channels[1], white_protect)
+        if verbose:
+            print(f"Masked pixels: {mask.histogram()[255]}")
+        return Image.composite(_as_rgba(bg), _as_rgba(fg), mask)
+    fg_data = _rgba_array(fg)
+    bg_data = _rgba_array(bg)
+    if njit is not None:
+        # Single fused pass over the pixels, no intermediate masks
+        output = np.empty_like(fg_data)
+        masked = _chroma_fuse(fg_data, bg_data, r, g, b, tolerance * tolerance, dominant_channel,
+                              other_channels[0], other_channels[1], white_protect, output)
+        if verbose:
+            print(f"Masked pixels: {masked}")
+        return Image.frombuffer('RGBA', fg.size, output, 'raw', 'RGBA', 0, 1)
+    mask = _key_mask(fg_data, r, g, b, tolerance, dominant_channel,
+                     other_channels[0], other_channels[1], white_protect)
+    if verbose:
+        print(f"Masked pixels: {np.sum(mask)}")
+    # Start from the foreground and only write the (usually few) keyed pixels from the background
+    output = fg_data.copy()
+    np.copyto(output, bg_data, where=mask[:, :, None])
+    return Image.frombuffer('RGBA', fg.size, output, 'raw', 'RGBA', 0, 1)
 
 
 def main():
@@ -95,7 +280,7 @@ def main():
     bg = Image.open(args.background)
     fg, bg = resize_to_match(fg, bg)
     keycolor = hex_to_rgb(args.keycolor)
-    result = chroma_key(fg, bg, keycolor, args.tolerance)
+    result = chroma_key(fg, bg, keycolor, args.tolerance, verbose=args.verbose)
     result.save(args.output)
     print(f"Chroma key output saved to {args.output}")
 
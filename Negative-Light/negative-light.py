@@ -2,9 +2,16 @@ import argparse
 import os
 import re
 import numpy as np # Import NumPy
-from PIL import Image, ImageOps, UnidentifiedImageError
+from PIL import Image, UnidentifiedImageError
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; apply_light falls back to plain numpy
+    njit = None
+    prange = range
 # import traceback # Uncomment for detailed error trace
 
+_HEX_RE = re.compile(r'^[0-9a-fA-F]{6}$')
+
 
 def hex_to_rgb(hex_color):
     """
@@ -13,9 +20,10 @@ def hex_to_rgb(hex_color):
     :return:
     """
     hex_color = hex_color.lstrip('#')
-    if not re.match(r'^[0-9a-fA-F]{6}$', hex_color):
+    if not _HEX_RE.match(hex_color):
         raise ValueError("Invalid hex color format. Use RRGGBB or #RRGGBB.")
-    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    value = int(hex_color, 16)
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
 
 
 def get_yes_no(prompt):
@@ -96,6 +104,15 @@ def get_hex_color(prompt):
             return None
 
 
+def _as_rgba(img):
+    """
+    Return the image in RGBA mode, skipping the full-image copy convert() makes when it already is.
+    :param img:
+    :return:
+    """
+    return img if img.mode == 'RGBA' else img.convert('RGBA')
+
+
 def create_negative(image_path):
     """
     Creates a photo negative of the given image.
@@ -107,21 +124,18 @@ def create_negative(image_path):
         img = Image.open(image_path)
         # Ensure image is loaded correctly
         img.load()
-        # 1. Create the color inverted version (traditional negative part)
-        # Ensure image is in RGB mode for inversion
-        img_rgb = img.convert('RGB')
-        inverted_rgb = ImageOps.invert(img_rgb)
-        # 2. Create the alpha channel based on original brightness
-        # Convert original image to grayscale ('L' mode)
+        # Work on a single RGBA array so inversion and alpha happen in one pass
+        arr = np.array(_as_rgba(img))
+        rgb = arr[:, :, :3]
+        # 1. Create the alpha channel based on original brightness (before inverting in place)
+        # Grayscale with the same fixed-point ITU-R 601 weights Pillow uses for convert('L')
         # Brighter original pixels will have higher values (closer to 255) = denser negative
-        alpha_channel = img.convert('L')
-        # 3. Combine inverted color with the brightness-based alpha
-        # Convert the inverted color image to RGBA
-        negative_rgba = inverted_rgb.convert('RGBA')
-        # Apply the grayscale brightness map as the alpha channel
-        negative_rgba.putalpha(alpha_channel)
+        r, g, b = (rgb[:, :, c].astype(np.uint32) for c in range(3))
+        arr[:, :, 3] = (19595 * r + 38470 * g + 7471 * b + 0x8000) >> 16
+        # 2. Create the color inverted version (traditional negative part)
+        np.subtract(255, rgb, out=rgb)
         print("Negative created successfully.")
-        return negative_rgba
+        return Image.frombuffer('RGBA', img.size, arr, 'raw', 'RGBA', 0, 1)
     except FileNotFoundError:
         print(f"Error: Input file not found at '{image_path}'")
         return None
@@ -134,6 +148,36 @@ def create_negative(image_path):
         return None
 
 
+def _apply_light_kernel(negative, inverted_light, out):
+    """
+    Fused light kernel: divide, multiply and clip per pixel in one pass over the negative.
+    :param negative: contiguous (H, W, 4) uint8 RGBA negative
+    :param inverted_light: float32 array of 255 - light color
+    :param out: (H, W, 3) uint8 array that receives the corrected RGB
+    :return:
+    """
+    height, width = negative.shape[0], negative.shape[1]
+    for y in prange(height):
+        for x in range(width):
+            a = np.float32(negative[y, x, 3])
+            if a == 0:
+                for c in range(3):
+                    out[y, x, c] = 0
+                continue
+            factor = (np.float32(255.0) - a) / a
+            for c in range(3):
+                v = (np.float32(255.0) - np.float32(negative[y, x, c])) + inverted_light[c] * factor
+                if v < 0:
+                    v = 0
+                elif v > 255:
+                    v = 255
+                out[y, x, c] = int(v)
+
+
+if njit is not None:
+    _apply_light_kernel = njit(parallel=True, fastmath=True, cache=True)(_apply_light_kernel)
+
+
 def apply_light(negative_image, light_color_rgb):
     """
     Applies a colored light effect to the negative image.
@@ -146,34 +190,32 @@ def apply_light(negative_image, light_color_rgb):
         if not isinstance(negative_image, Image.Image) or negative_image.mode != 'RGBA':
              print("Error: apply_light requires a valid RGBA negative image.")
              return None
-        # 1. Create a solid background layer of the light color
-        color_layer = Image.new('RGB', negative_image.size, light_color_rgb)
-        color_layer_rgba = color_layer.convert('RGBA')
-        # 2. Composite the negative onto the color layer
-        intermediate_image = Image.alpha_composite(color_layer_rgba, negative_image)
-        # 3. Invert the composite result (gives OriginalColor * Alpha/255)
-        inverted_composite_rgb = ImageOps.invert(intermediate_image.convert('RGB'))
-        # --- Brightness Correction using NumPy ---
+        # Compositing over the light color, inverting, then rescaling by 255/alpha collapses to one formula:
+        #   C  = light * (255 - A)/255 + negative * A/255      (alpha composite over the light layer)
+        #   C' = 255 - C                                        (invert)
+        #   out = C' * 255/A = (255 - negative) + (255 - light) * (255 - A)/A
         print("Applying brightness correction...")
-        # Get the original brightness map (alpha channel)
-        alpha_channel = negative_image.getchannel('A')
-        # Convert images to NumPy arrays for calculation (use float for precision)
-        rgb_array = np.array(inverted_composite_rgb, dtype=np.float32)
-        alpha_array = np.array(alpha_channel, dtype=np.float32)
-        # Avoid division by zero: where alpha is 0, the rgb is already 0 (black),
-        # so scaling factor doesn't matter. We'll use np.divide's 'where' clause.
-        # Create scale factor: 255.0 / alpha. Add a dimension for broadcasting over RGB channels.
-        # Use a small epsilon to prevent true zero division if needed, though 'where' is better.
-        scale_factor = np.zeros_like(alpha_array)
-        np.divide(255.0, alpha_array, out=scale_factor, where=alpha_array != 0)
-        scale_factor_rgb = np.expand_dims(scale_factor, axis=-1) # Shape (H, W, 1)
-        # Apply scaling: Corrected RGB = (OriginalColor * Alpha/255) * (255 / Alpha)
-        corrected_rgb_array = rgb_array * scale_factor_rgb
+        inverted_light = 255.0 - np.asarray(light_color_rgb, dtype=np.float32)
+        if njit is not None:
+            # Numba available: evaluate the formula per pixel in one fused pass
+            negative_array = np.ascontiguousarray(np.asarray(negative_image, dtype=np.uint8))
+            final_rgb_array = np.empty(negative_array.shape[:2] + (3,), dtype=np.uint8)
+            _apply_light_kernel(negative_array, inverted_light, final_rgb_array)
+            print("Brightness correction applied.")
+            return Image.frombuffer('RGB', negative_image.size, final_rgb_array, 'raw', 'RGB', 0, 1)
+        # Convert the negative to a NumPy array for calculation (use float for precision)
+        negative_array = np.asarray(negative_image, dtype=np.float32)
+        alpha_array = negative_array[:, :, 3]
+        # Avoid division by zero: where alpha is 0 the result is black, so leave the factor at 0 there
+        light_factor = np.zeros_like(alpha_array)
+        np.divide(255.0 - alpha_array, alpha_array, out=light_factor, where=alpha_array != 0)
+        corrected_rgb_array = (255.0 - negative_array[:, :, :3]) + inverted_light * light_factor[:, :, None]
+        corrected_rgb_array[alpha_array == 0] = 0
         # Clamp values to the valid 0-255 range and convert back to uint8
         corrected_rgb_array = np.clip(corrected_rgb_array, 0, 255)
         final_rgb_array = corrected_rgb_array.astype(np.uint8)
-        # Convert NumPy array back to PIL Image
-        final_image = Image.fromarray(final_rgb_array, 'RGB')
+        # Wrap the NumPy buffer as a PIL Image (no extra copy)
+        final_image = Image.frombuffer('RGB', negative_image.size, final_rgb_array, 'raw', 'RGB', 0, 1)
         print("Brightness correction applied.")
         return final_image
     except ImportError:
@@ -1,9 +1,26 @@
 # chromakey.py
-from PIL import Image
+import re
+from PIL import Image, ImageChops, ImageMath
 import numpy as np
 import os
-import glob
-from logger import log
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fileio import get_sequence_files, finish_write, run_frame_pool, FAST_PNG_COMPRESSION, DEFAULT_PNG_COMPRESSION
+from logger import log, log_error
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; chroma_key falls back to plain numpy
+    njit = None
+    prange = range
+
+_HEX_RE = re.compile(r'^[0-9a-fA-F]{6}$')
+# Below this many pixels chroma_key stays in Pillow instead of going through numpy
+_SMALL_IMAGE_PIXELS = 200_000
+# Image.Resampling on Pillow 9.1+, the old module-level constants before that
+_BILINEAR = getattr(Image, 'Resampling', Image).BILINEAR
+# How far each pool worker decodes ahead / encodes behind
+_READ_AHEAD = 2
+_WRITE_BEHIND = 2
 
 
 def hex_to_rgb(hexcolor):
@@ -13,7 +30,30 @@ def hex_to_rgb(hexcolor):
     :return:
     """
     hexcolor = hexcolor.lstrip('#')
-    return tuple(int(hexcolor[i:i+2], 16) for i in (0, 2, 4))
+    if not _HEX_RE.match(hexcolor):
+        raise ValueError("Invalid hex color format. Use RRGGBB or #RRGGBB.")
+    value = int(hexcolor, 16)
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+
+def _resize(img, size):
+    """
+    Bilinear resize. When an axis shrinks by 2x or more, Image.reduce first drops it by the whole factor
+    (a cheap box filter) so the bilinear pass only covers what is left.
+    :param img:
+    :param size: target (width, height)
+    :return:
+    """
+    factor_x = max(1, img.size[0] // size[0])
+    factor_y = max(1, img.size[1] // size[1])
+    if factor_x > 1 or factor_y > 1:
+        try:
+            img = img.reduce((factor_x, factor_y))
+        except ValueError:
+            pass  # reduce() doesn't take palette/bilevel/16-bit modes; plain resize handles them
+    if img.size == size:
+        return img
+    return img.resize(size, _BILINEAR)
 
 
 def resize_to_match(img1, img2):
@@ -26,12 +66,182 @@ def resize_to_match(img1, img2):
     if img1.size == img2.size:
         return img1, img2
     if img1.size[0] * img1.size[1] > img2.size[0] * img2.size[1]:
-        img2 = img2.resize(img1.size, Image.BILINEAR)
+        img2 = _resize(img2, img1.size)
     else:
-        img1 = img1.resize(img2.size, Image.BILINEAR)
+        img1 = _resize(img1, img2.size)
     return img1, img2
 
 
+def _as_rgba(img):
+    """
+    Return the image in RGBA mode, skipping the full-image copy convert() makes when it already is.
+    :param img:
+    :return:
+    """
+    return img if img.mode == 'RGBA' else img.convert('RGBA')
+
+
+def _rgba_array(img):
+    """
+    Read-only (H, W, 4) uint8 view of an image's RGBA pixels, wrapped straight from tobytes() without another copy.
+    :param img:
+    :return:
+    """
+    img = _as_rgba(img)
+    width, height = img.size
+    return np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(height, width, 4)
+
+
+def _chroma_fuse(fg, bg, r, g, b, tol2, dom_idx, o1, o2, white_protect, out):
+    """
+    Fused chroma key kernel: walk every pixel once and write either the foreground or background RGBA into out.
+    :param fg: contiguous uint8 RGBA foreground array
+    :param bg: contiguous uint8 RGBA background array
+    :param r:
+    :param g:
+    :param b:
+    :param tol2: squared tolerance
+    :param dom_idx: dominant channel of the key color
+    :param o1: first of the other two channels
+    :param o2: second of the other two channels
+    :param white_protect:
+    :param out: uint8 RGBA output array, same shape as fg
+    :return: number of pixels taken from the background
+    """
+    height, width = fg.shape[0], fg.shape[1]
+    bright = 3 * white_protect
+    masked = 0
+    for y in prange(height):
+        for x in range(width):
+            fr = int(fg[y, x, 0])
+            fgr = int(fg[y, x, 1])
+            fb = int(fg[y, x, 2])
+            dr = fr - r
+            dg = fgr - g
+            db = fb - b
+            dom = int(fg[y, x, dom_idx])
+            keyed = (dr * dr + dg * dg + db * db < tol2 and
+                     dom > int(fg[y, x, o1]) + 10 and
+                     dom > int(fg[y, x, o2]) + 10 and
+                     fr + fgr + fb <= bright)
+            if keyed:
+                masked += 1
+                for c in range(4):
+                    out[y, x, c] = bg[y, x, c]
+            else:
+                for c in range(4):
+                    out[y, x, c] = fg[y, x, c]
+    return masked
+
+
+if njit is not None:
+    _chroma_fuse = njit(parallel=True, fastmath=True, cache=True)(_chroma_fuse)
+
+
+def _key_mask(fg_data, r, g, b, tolerance, dom_idx, o1, o2, white_protect):
+    """
+    Numpy chroma key mask. A pixel can only be within tolerance of the key if every channel is, so a cheap
+    per-channel range check on the raw uint8 data picks the candidates and only those get the full
+    squared-distance, dominance and brightness tests.
+    :param fg_data: (H, W, 4) uint8 foreground array
+    :param r:
+    :param g:
+    :param b:
+    :param tolerance:
+    :param dom_idx: dominant channel of the key color
+    :param o1: first of the other two channels
+    :param o2: second of the other two channels
+    :param white_protect:
+    :return: (H, W) bool mask of pixels to take from the background
+    """
+    height, width = fg_data.shape[0], fg_data.shape[1]
+    candidates = np.ones((height, width), dtype=bool)
+    for channel, key in enumerate((r, g, b)):
+        candidates &= (fg_data[:, :, channel] > key - tolerance) & (fg_data[:, :, channel] < key + tolerance)
+    idx = np.flatnonzero(candidates)
+    px = fg_data.reshape(-1, 4)[idx, :3]
+    diff2 = np.zeros(idx.size, dtype=np.int32)
+    tmp = np.empty(idx.size, dtype=np.int32)
+    for channel, key in enumerate((r, g, b)):
+        np.subtract(px[:, channel], key, out=tmp, dtype=np.int32)
+        np.multiply(tmp, tmp, out=tmp)
+        np.add(diff2, tmp, out=diff2)
+    keep = diff2 < tolerance * tolerance
+    for other in (o1, o2):
+        np.subtract(px[:, dom_idx], px[:, other], out=tmp, dtype=np.int32)
+        keep &= tmp > 10
+    np.add(px[:, 0], px[:, 1], out=tmp, dtype=np.int32)
+    np.add(tmp, px[:, 2], out=tmp)
+    keep &= tmp <= 3 * white_protect
+    mask = np.zeros(height * width, dtype=bool)
+    mask[idx[keep]] = True
+    return mask.reshape(height, width)
+
+
+def _precompute_key(keycolor, tolerance, white_protect=180):
+    """
+    Derive the per-sequence key constants once, so the per-frame path only does pixel work.
+    :param keycolor:
+    :param tolerance:
+    :param white_protect:
+    :return: (r, g, b, dominant channel, other channel, other channel, tolerance, squared tolerance, white_protect)
+    """
+    r, g, b = keycolor
+    dominant_channel = int(np.argmax(np.array([r, g, b])))
+    other_channels = [i for i in range(3) if i != dominant_channel]
+    return (r, g, b, dominant_channel, other_channels[0], other_channels[1],
+            tolerance, tolerance * tolerance, white_protect)
+
+
+def _apply_key(fg_data, bg_data, params, out):
+    """
+    Apply chroma key to RGBA uint8 arrays, writing the composite into a caller-owned output buffer.
+    :param fg_data: contiguous (H, W, 4) uint8 foreground array
+    :param bg_data: contiguous (H, W, 4) uint8 background array
+    :param params: key constants from _precompute_key
+    :param out: contiguous (H, W, 4) uint8 array that receives the result
+    :return: out
+    """
+    r, g, b, dom_idx, o1, o2, tolerance, tol2, white_protect = params
+    if njit is not None:
+        _chroma_fuse(fg_data, bg_data, r, g, b, tol2, dom_idx, o1, o2, white_protect, out)
+        return out
+    mask = _key_mask(fg_data, r, g, b, tolerance, dom_idx, o1, o2, white_protect)
+    # Start from the foreground and only write the (usually few) keyed pixels from the background
+    np.copyto(out, fg_data)
+    np.copyto(out, bg_data, where=mask[:, :, None])
+    return out
+
+
+def _key_mask_pil(fg, r, g, b, tolerance, dom_idx, o1, o2, white_protect):
+    """
+    Pillow-only chroma key mask for small images, where setting up numpy arrays costs more than the pixel work.
+    Same tests as _key_mask, evaluated by libImaging on 32-bit ImageMath images.
+    :param fg:
+    :param r:
+    :param g:
+    :param b:
+    :param tolerance:
+    :param dom_idx: dominant channel of the key color
+    :param o1: first of the other two channels
+    :param o2: second of the other two channels
+    :param white_protect:
+    :return: 'L' mask, 255 where the background shows through
+    """
+    rgb = fg if fg.mode == "RGB" else fg.convert("RGB")
+    dr, dg, db = ImageChops.difference(rgb, Image.new("RGB", rgb.size, (r, g, b))).split()
+    channels = rgb.split()
+    tol2 = tolerance * tolerance
+    bright = 3 * white_protect
+    mask = ImageMath.lambda_eval(
+        lambda a: (((a['dr'] * a['dr'] + a['dg'] * a['dg'] + a['db'] * a['db']) < tol2) &
+                   (a['dom'] > a['o1'] + 10) & (a['dom'] > a['o2'] + 10) &
+                   (a['r'] + a['g'] + a['b'] <= bright)) * 255,
+        dr=dr, dg=dg, db=db, dom=channels[dom_idx], o1=channels[o1], o2=channels[o2],
+        r=channels[0], g=channels[1], b=channels[2])
+    return mask.convert("L")
+
+
 def chroma_key(fg, bg, keycolor, tolerance, white_protect=180):
     """
     Apply chroma key effect to the foreground image using the specified key color and background image.
@@ -42,29 +252,135 @@ def chroma_key(fg, bg, keycolor, tolerance, white_protect=180):
     :param white_protect:
     :return:
     """
-    fg_data = np.array(fg.convert("RGBA"))
-    bg_data = np.array(bg.convert("RGBA"))
-    r, g, b = keycolor
-    diff = np.sqrt(
-        (fg_data[:, :, 0] - r) ** 2 +
-        (fg_data[:, :, 1] - g) ** 2 +
-        (fg_data[:, :, 2] - b) ** 2
-    )
-    key_rgb = np.array([r, g, b])
-    dominant_channel = np.argmax(key_rgb)
-    other_channels = [i for i in range(3) if i != dominant_channel]
-    pixel_dominant = (
-        (fg_data[:, :, dominant_channel] > fg_data[:, :, other_channels[0]] + 10) &
-        (fg_data[:, :, dominant_channel] > fg_data[:, :, other_channels[1]] + 10)
-    )
-    luma = fg_data[:, :, :3].mean(axis=2)
-    is_bright = luma > white_protect
-    mask = (diff < tolerance) & pixel_dominant & (~is_bright)
-    output = np.where(mask[:, :, None], bg_data, fg_data)
-    return Image.fromarray(output, 'RGBA')
+    params = _precompute_key(keycolor, tolerance, white_protect)
+    if fg.size[0] * fg.size[1] < _SMALL_IMAGE_PIXELS and hasattr(ImageMath, 'lambda_eval'):
+        r, g, b, dom_idx, o1, o2, tolerance, _, white_protect = params
+        mask = _key_mask_pil(fg, r, g, b, tolerance, dom_idx, o1, o2, white_protect)
+        return Image.composite(_as_rgba(bg), _as_rgba(fg), mask)
+    fg_data = _rgba_array(fg)
+    bg_data = _rgba_array(bg)
+    output = np.empty_like(fg_data)
+    _apply_key(fg_data, bg_data, params, output)
+    return Image.frombuffer('RGBA', fg.size, output, 'raw', 'RGBA', 0, 1)
+
+
+# Per-process state for pool workers, filled in by _init_worker
+_worker = {}
+
+
+def _init_worker(key_params, static_bg_path):
+    """
+    Pool initializer: keep the sequence settings in the worker so tasks only carry file paths.
+    :param key_params: key constants from _precompute_key
+    :param static_bg_path: path of the static background, or None for a background sequence
+    :return:
+    """
+    _worker['key_params'] = key_params
+    _worker['static_bg_path'] = static_bg_path
+    _worker['static_bg'] = None  # (foreground size, matched size, RGBA array) once loaded
+
+
+def _static_background(fg):
+    """
+    Match a foreground frame against the static background, converting and resizing the background only once
+    per foreground size instead of copying it for every frame.
+    :param fg:
+    :return: (fg resized if needed, contiguous RGBA uint8 background array)
+    """
+    cached = _worker['static_bg']
+    if cached is None or cached[0] != fg.size:
+        with Image.open(_worker['static_bg_path']) as static_bg:
+            matched_fg, bg = resize_to_match(fg, static_bg)
+            cached = (fg.size, matched_fg.size, _rgba_array(bg))
+        _worker['static_bg'] = cached
+    if fg.size != cached[1]:
+        fg = _resize(fg, cached[1])
+    return fg, cached[2]
+
+
+def _load_task(task):
+    """
+    Decode the foreground (and background, if the task has one) of a frame (runs on the worker's I/O threads).
+    :param task: (frame index, foreground path, background path or None for the static background, output path)
+    :return: (foreground, background or None)
+    """
+    fg = Image.open(task[1])
+    fg.load()
+    bg = None
+    if task[2] is not None:
+        bg = Image.open(task[2])
+        bg.load()
+    return fg, bg
+
+
+def _key_frame(fg, bg, out_buf):
+    """
+    Chroma key one decoded frame into out_buf, resizing it first if it needs to.
+    :param fg:
+    :param bg: background frame, or None for the static background
+    :param out_buf: RGBA uint8 array; replaced by a new one if the frame size doesn't match
+    :return: the array holding the result
+    """
+    if bg is None:
+        fg, bg_data = _static_background(fg)
+    else:
+        fg, bg = resize_to_match(fg, bg)
+        bg_data = _rgba_array(bg)
+    # _rgba_array already hands back fresh contiguous arrays, so they go to the kernel as they are
+    fg_data = _rgba_array(fg)
+    if out_buf.shape != fg_data.shape:
+        out_buf = np.empty_like(fg_data)
+    _apply_key(fg_data, bg_data, _worker['key_params'], out_buf)
+    return out_buf
+
+
+def _save_frame(arr, out_path):
+    """
+    Encode a keyed frame straight from its buffer (runs on the worker's I/O threads).
+    :param arr: contiguous RGBA uint8 array
+    :param out_path:
+    :return:
+    """
+    height, width = arr.shape[:2]
+    Image.frombuffer('RGBA', (width, height), arr, 'raw', 'RGBA', 0, 1).save(
+        out_path, compress_level=FAST_PNG_COMPRESSION)
 
 
-def process(inputfile, outputfile, keycolor, workdir, sequence_prefix, tolerance=30, background_sequence=None):
+def _process_chunk(tasks):
+    """
+    Chroma key a run of frames inside a pool worker. PNG decode and encode release the GIL, so the next
+    frames are decoded and the previous ones encoded on a couple of threads while this one is keyed.
+    :param tasks: list of (frame index, foreground path, background path or None, output path)
+    :return: list of error messages, None for each frame written
+    """
+    results = []
+    # One more output buffer than can be waiting on an encode, so the next frame always has a free one
+    out_bufs = [np.empty((0, 0, 4), dtype=np.uint8) for _ in range(_WRITE_BEHIND + 1)]
+    slot = 0
+    with ThreadPoolExecutor(max_workers=_READ_AHEAD + 2) as pool:
+        reads = deque(pool.submit(_load_task, task) for task in tasks[:_READ_AHEAD])
+        writes = deque()
+        for n, (i, fg_path, bg_path, out_path) in enumerate(tasks):
+            future = reads.popleft()
+            if n + _READ_AHEAD < len(tasks):
+                reads.append(pool.submit(_load_task, tasks[n + _READ_AHEAD]))
+            try:
+                fg, bg = future.result()
+                out_bufs[slot] = _key_frame(fg, bg, out_bufs[slot])
+            except Exception as e:
+                results.append(f"Frame {i} failed: {e}")
+                continue
+            writes.append((pool.submit(_save_frame, out_bufs[slot], out_path), out_path))
+            slot = (slot + 1) % len(out_bufs)
+            while len(writes) > _WRITE_BEHIND or (writes and writes[0][0].done()):
+                results.append(finish_write(*writes.popleft()))
+        while writes:
+            results.append(finish_write(*writes.popleft()))
+    return results
+
+
+def process(inputfile, outputfile, keycolor, workdir, sequence_prefix, tolerance=200, background_sequence=None,
+            fast_encode=False):
     """
 Process a single image or a sequence of images for chroma keying.
     :param inputfile:
@@ -74,25 +390,26 @@ Process a single image or a sequence of images for chroma keying.
     :param sequence_prefix:
     :param tolerance:
     :param background_sequence:
+    :param fast_encode: write a single-image PNG output with minimal compression too
     :return:
     """
     key_rgb = hex_to_rgb(keycolor)
     if os.path.isfile(inputfile):
         if not background_sequence or not os.path.isfile(background_sequence):
-            print("Error: Background file required for single image input.")
+            log_error("Error: Background file required for single image input.")
             return
         try:
             fg = Image.open(inputfile)
             bg = Image.open(background_sequence)
             fg, bg = resize_to_match(fg, bg)
             result = chroma_key(fg, bg, key_rgb, tolerance)
-            result.save(outputfile)
+            result.save(outputfile, compress_level=FAST_PNG_COMPRESSION if fast_encode else DEFAULT_PNG_COMPRESSION)
         except Exception as e:
-            print(f"Error processing single image: {e}")
+            log_error(f"Error processing single image: {e}")
     else:
-        fg_frames = sorted(glob.glob(os.path.join(inputfile, f"{sequence_prefix}_*.png")))
+        fg_frames = get_sequence_files(inputfile, sequence_prefix)
         if not fg_frames:
-            print(f"Error: No foreground frames found in {inputfile}")
+            log_error(f"Error: No foreground frames found in {inputfile}")
             return
         use_static = False
         static_bg = None
@@ -104,30 +421,23 @@ Process a single image or a sequence of images for chroma keying.
                     use_static = True
                     log(f"Using static background image: {background_sequence}")
                 except Exception as e:
-                    print(f"Error loading static background: {e}")
+                    log_error(f"Error loading static background: {e}")
                     return
             elif os.path.isdir(background_sequence):
-                bg_frames = sorted(glob.glob(os.path.join(background_sequence, f"{sequence_prefix}_*.png")))
+                bg_frames = get_sequence_files(background_sequence, sequence_prefix)
                 if not bg_frames:
-                    print(f"Error: No background sequence found in {background_sequence}")
+                    log_error(f"Error: No background sequence found in {background_sequence}")
                     return
                 log(f"Using background frame sequence from: {background_sequence}")
             else:
-                print(f"Error: Invalid background path: {background_sequence}")
+                log_error(f"Error: Invalid background path: {background_sequence}")
                 return
         else:
-            print("Error: No background sequence or static background provided.")
+            log_error("Error: No background sequence or static background provided.")
             return
         frame_count = len(fg_frames) if use_static else min(len(fg_frames), len(bg_frames))
-        for i in range(frame_count):
-            try:
-                if i % 30 == 0 or i == frame_count - 1:
-                    log(f"Processing frame {i + 1} of {frame_count}")
-                fg = Image.open(fg_frames[i])
-                bg = static_bg.copy() if use_static else Image.open(bg_frames[i])
-                fg, bg = resize_to_match(fg, bg)
-                result = chroma_key(fg, bg, key_rgb, tolerance)
-                out_path = os.path.join(workdir, f"{sequence_prefix}_{i:04}.png")
-                result.save(out_path)
-            except Exception as e:
-                print(f"Frame {i} failed: {e}")
+        tasks = [(i, fg_frames[i], None if use_static else bg_frames[i],
+                  os.path.join(workdir, f"{sequence_prefix}_{i:04}.png")) for i in range(frame_count)]
+        static_bg_path = background_sequence if use_static else None
+        key_params = _precompute_key(key_rgb, tolerance)
+        run_frame_pool(tasks, _process_chunk, _init_worker, (key_params, static_bg_path), "Processed frame")
@@ -1,7 +1,15 @@
 # fileio.py
 import os
-import glob
-from logger import log
+import sys
+import multiprocessing
+from logger import log, log_error
+
+# zlib level for PNG frames written to the working directory. They are read back once and then deleted,
+# so encode speed matters far more than file size (-1 leaves Pillow at its default of 6)
+FAST_PNG_COMPRESSION = 1
+DEFAULT_PNG_COMPRESSION = -1
+# Sequence frames handed to a pool worker at once
+FRAMES_PER_TASK = 8
 
 
 def ensure_working_directory(path):
@@ -21,8 +29,14 @@ def get_sequence_files(directory, prefix):
     :param prefix:
     :return:
     """
-    pattern = os.path.join(directory, f"{prefix}_*.png")
-    return sorted(glob.glob(pattern))
+    if not os.path.isdir(directory):
+        return []
+    start = f"{prefix}_"
+    # scandir hands back names without a stat per entry, unlike glob
+    with os.scandir(directory) as entries:
+        names = [e.name for e in entries if e.name.startswith(start) and e.name.endswith(".png")]
+    names.sort()
+    return [os.path.join(directory, name) for name in names]
 
 
 def cleanup_sequence(root_dir, prefix):
@@ -46,16 +60,72 @@ def cleanup_sequence(root_dir, prefix):
                 os.remove(f)
                 # log(f"Deleted file: {f}")
             except Exception as e:
-                log(f"Failed to delete file: {f} — {e}")
+                log_error(f"Failed to delete file: {f} — {e}")
         if os.path.isdir(path) and not os.listdir(path):
             try:
                 os.rmdir(path)
                 log(f"Deleted empty directory: {path}")
             except Exception as e:
-                log(f"Failed to delete directory: {path} — {e}")
+                log_error(f"Failed to delete directory: {path} — {e}")
     if os.path.isdir(root_dir) and not os.listdir(root_dir):
         try:
             os.rmdir(root_dir)
             log(f"Deleted empty working directory: {root_dir}")
         except Exception as e:
-            log(f"Failed to delete working directory: {root_dir} — {e}")
+            log_error(f"Failed to delete working directory: {root_dir} — {e}")
+
+
+def finish_write(future, out_path):
+    """
+    Wait for a queued frame encode.
+    :param future:
+    :param out_path:
+    :return: error message, or None if the frame was written
+    """
+    try:
+        future.result()
+    except Exception as e:
+        return f"Error saving image '{out_path}': {e}"
+    return None
+
+
+def _init_pool_worker(initializer, initargs):
+    """
+    Pool initializer: cap numba at one thread if the frame operation uses it, then run the operation's own setup.
+    :param initializer:
+    :param initargs:
+    :return:
+    """
+    # Frames are already spread across processes; don't let each one spin up a full numba thread pool too.
+    # Unpickling the initializer has imported the operation's module, and with it numba if it is used
+    numba = sys.modules.get('numba')
+    if numba is not None:
+        numba.set_num_threads(1)
+    initializer(*initargs)
+
+
+def run_frame_pool(tasks, process_chunk, initializer, initargs, progress):
+    """
+    Split per-frame tasks into runs of frames and spread them across one process per core.
+    :param tasks: list of per-frame tasks, in frame order
+    :param process_chunk: module-level function taking a list of tasks and returning an error message or None
+        for each of them
+    :param initializer: module-level function that sets up the per-process state process_chunk needs
+    :param initargs: arguments for initializer
+    :param progress: log message prefix, followed by "<done> of <total>"
+    :return:
+    """
+    frame_count = len(tasks)
+    workers = os.cpu_count() or 1
+    # Short sequences still get split across every worker
+    per_task = max(1, min(FRAMES_PER_TASK, -(-frame_count // workers)))
+    chunks = [tasks[n:n + per_task] for n in range(0, frame_count, per_task)]
+    done = 0
+    with multiprocessing.Pool(workers, initializer=_init_pool_worker, initargs=(initializer, initargs)) as pool:
+        for results in pool.imap_unordered(process_chunk, chunks):
+            for error in results:
+                done += 1
+                if error:
+                    log_error(error)
+                if done % 30 == 1 or done == frame_count:
+                    log(f"{progress} {done} of {frame_count}")
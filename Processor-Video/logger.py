@@ -1,5 +1,23 @@
 # logger.py
-import datetime
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Records are queued by the caller and written to stdout by a background listener thread,
+# so frame loops never block on console I/O
+_queue = queue.SimpleQueue()
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', datefmt='%Y-%m-%d %I:%M:%S %p'))
+_listener = logging.handlers.QueueListener(_queue, _handler)
+_listener.start()
+atexit.register(_listener.stop)
+
+_logger = logging.getLogger('processor')
+_logger.setLevel(logging.INFO)
+_logger.propagate = False
+_logger.addHandler(logging.handlers.QueueHandler(_queue))
 
 
 def log(message):
@@ -8,5 +26,13 @@ def log(message):
     :param message:
     :return:
     """
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')
-    print(f'{timestamp} {message}')
\ No newline at end of file
+    _logger.info(message)
+
+
+def log_error(message):
+    """
+    Log an error with a timestamp, through the same queue as log() so it lands in order with the progress lines.
+    :param message:
+    :return:
+    """
+    _logger.error(message)
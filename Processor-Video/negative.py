@@ -2,9 +2,21 @@
 import re
 import numpy as np
 import os
-import glob
-from PIL import Image, ImageOps, UnidentifiedImageError
-from logger import log
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, UnidentifiedImageError
+from fileio import get_sequence_files, finish_write, run_frame_pool, FAST_PNG_COMPRESSION, DEFAULT_PNG_COMPRESSION
+from logger import log, log_error
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; apply_light falls back to plain numpy
+    njit = None
+    prange = range
+
+_HEX_RE = re.compile(r'^[0-9a-fA-F]{6}$')
+# How far each pool worker decodes ahead / encodes behind
+_READ_AHEAD = 2
+_WRITE_BEHIND = 4
 
 
 def hex_to_rgb(hex_color):
@@ -14,9 +26,33 @@ def hex_to_rgb(hex_color):
     :return:
     """
     hex_color = hex_color.lstrip('#')
-    if not re.match(r'^[0-9a-fA-F]{6}$', hex_color):
+    if not _HEX_RE.match(hex_color):
         raise ValueError("Invalid hex color format. Use RRGGBB or #RRGGBB.")
-    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    value = int(hex_color, 16)
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+
+def _as_rgba(img):
+    """
+    Return the image in RGBA mode, skipping the full-image copy convert() makes when it already is.
+    :param img:
+    :return:
+    """
+    return img if img.mode == 'RGBA' else img.convert('RGBA')
+
+
+def _negative_inplace(arr):
+    """
+    Turn an RGBA uint8 array into its negative in place: brightness into alpha, then invert RGB.
+    :param arr: writable (H, W, 4) uint8 array
+    :return: arr
+    """
+    rgb = arr[:, :, :3]
+    r, g, b = (rgb[:, :, c].astype(np.uint32) for c in range(3))
+    # Same fixed-point ITU-R 601 weights Pillow uses for convert('L')
+    arr[:, :, 3] = (19595 * r + 38470 * g + 7471 * b + 0x8000) >> 16
+    np.subtract(255, rgb, out=rgb)
+    return arr
 
 
 def create_negative(image_path):
@@ -29,21 +65,70 @@ def create_negative(image_path):
         log(f"Creating negative for image: '{image_path}'")
         img = Image.open(image_path)
         img.load()
-        img_rgb = img.convert('RGB')
-        inverted_rgb = ImageOps.invert(img_rgb)
-        alpha_channel = img.convert('L')
-        negative_rgba = inverted_rgb.convert('RGBA')
-        negative_rgba.putalpha(alpha_channel)
-        return negative_rgba
+        arr = _negative_inplace(np.array(_as_rgba(img)))
+        return Image.frombuffer('RGBA', img.size, arr, 'raw', 'RGBA', 0, 1)
     except FileNotFoundError:
-        print(f"Error: File not found: '{image_path}'")
+        log_error(f"Error: File not found: '{image_path}'")
     except UnidentifiedImageError:
-        print(f"Error: Unrecognized image format: '{image_path}'")
+        log_error(f"Error: Unrecognized image format: '{image_path}'")
     except Exception as e:
-        print(f"Error during negative creation: {e}")
+        log_error(f"Error during negative creation: {e}")
     return None
 
 
+def _apply_light_kernel(negative, inverted_light, out):
+    """
+    Fused light kernel: divide, multiply and clip per pixel in one pass over the negative.
+    :param negative: contiguous (H, W, 4) uint8 RGBA negative
+    :param inverted_light: float32 array of 255 - light color
+    :param out: (H, W, 3) uint8 array that receives the corrected RGB
+    :return:
+    """
+    height, width = negative.shape[0], negative.shape[1]
+    for y in prange(height):
+        for x in range(width):
+            a = np.float32(negative[y, x, 3])
+            if a == 0:
+                for c in range(3):
+                    out[y, x, c] = 0
+                continue
+            factor = (np.float32(255.0) - a) / a
+            for c in range(3):
+                v = (np.float32(255.0) - np.float32(negative[y, x, c])) + inverted_light[c] * factor
+                if v < 0:
+                    v = 0
+                elif v > 255:
+                    v = 255
+                out[y, x, c] = int(v)
+
+
+if njit is not None:
+    _apply_light_kernel = njit(parallel=True, fastmath=True, cache=True)(_apply_light_kernel)
+
+
+def _light_array(negative_array, inverted_light):
+    """
+    Apply the light to an RGBA negative array and return the corrected RGB uint8 array.
+    Compositing over the light color, inverting, and rescaling by 255/alpha reduces to a single formula:
+    (255 - negative) + (255 - light) * (255 - alpha) / alpha
+    :param negative_array: (H, W, 4) uint8 RGBA negative
+    :param inverted_light: float32 array of 255 - light color
+    :return:
+    """
+    if njit is not None:
+        negative_array = np.ascontiguousarray(negative_array)
+        corrected_rgb_array = np.empty(negative_array.shape[:2] + (3,), dtype=np.uint8)
+        _apply_light_kernel(negative_array, inverted_light, corrected_rgb_array)
+        return corrected_rgb_array
+    negative_array = negative_array.astype(np.float32)
+    alpha_array = negative_array[:, :, 3]
+    light_factor = np.zeros_like(alpha_array)
+    np.divide(255.0 - alpha_array, alpha_array, out=light_factor, where=alpha_array != 0)
+    corrected_rgb_array = (255.0 - negative_array[:, :, :3]) + inverted_light * light_factor[:, :, None]
+    corrected_rgb_array[alpha_array == 0] = 0
+    return np.clip(corrected_rgb_array, 0, 255).astype(np.uint8)
+
+
 def apply_light(negative_image, light_color_rgb):
     """
     Apply a light color to the negative image and return the corrected RGB image.
@@ -53,45 +138,168 @@ def apply_light(negative_image, light_color_rgb):
     """
     try:
         if not isinstance(negative_image, Image.Image) or negative_image.mode != 'RGBA':
-            print("Error: Input must be an RGBA image.")
+            log_error("Error: Input must be an RGBA image.")
             return None
-        color_layer = Image.new('RGB', negative_image.size, light_color_rgb).convert('RGBA')
-        intermediate_image = Image.alpha_composite(color_layer, negative_image)
-        inverted_composite_rgb = ImageOps.invert(intermediate_image.convert('RGB'))
-        alpha_channel = negative_image.getchannel('A')
-        rgb_array = np.array(inverted_composite_rgb, dtype=np.float32)
-        alpha_array = np.array(alpha_channel, dtype=np.float32)
-        scale_factor = np.zeros_like(alpha_array)
-        np.divide(255.0, alpha_array, out=scale_factor, where=alpha_array != 0)
-        scale_factor_rgb = np.expand_dims(scale_factor, axis=-1)
-        corrected_rgb_array = rgb_array * scale_factor_rgb
-        corrected_rgb_array = np.clip(corrected_rgb_array, 0, 255).astype(np.uint8)
-        return Image.fromarray(corrected_rgb_array, 'RGB')
+        inverted_light = 255.0 - np.asarray(light_color_rgb, dtype=np.float32)
+        corrected_rgb_array = _light_array(np.asarray(negative_image, dtype=np.uint8), inverted_light)
+        return Image.frombuffer('RGB', negative_image.size, corrected_rgb_array, 'raw', 'RGB', 0, 1)
     except Exception as e:
-        print(f"Error during light application: {e}")
+        log_error(f"Error during light application: {e}")
     return None
 
-def save_image(image, filename):
+def save_image(image, filename, compress_level=DEFAULT_PNG_COMPRESSION):
     """
     Save the image to the specified filename.
     :param image:
     :param filename:
+    :param compress_level: zlib level for PNG output (ignored for other formats)
     :return:
     """
     if image is None or not filename:
-        print("Error: Invalid image or filename.")
+        log_error("Error: Invalid image or filename.")
         return False
     try:
         if filename.lower().endswith(('.jpg', '.jpeg')) and image.mode == 'RGBA':
             image = image.convert('RGB')
-        image.save(filename)
+        image.save(filename, compress_level=compress_level)
         return True
     except Exception as e:
-        print(f"Error saving image '{filename}': {e}")
+        log_error(f"Error saving image '{filename}': {e}")
     return False
 
 
-def process(inputfile, outputfile, operation, color, workdir, sequence_prefix):
+def _load_frame(frame_path):
+    """
+    Decode a frame into a writable RGBA uint8 array (runs on the I/O thread pool).
+    :param frame_path:
+    :return:
+    """
+    with Image.open(frame_path) as img:
+        return np.array(_as_rgba(img))
+
+
+def _save_frame(arr, mode, out_path):
+    """
+    Encode a frame array straight from its buffer (runs on the I/O thread pool).
+    :param arr: contiguous uint8 array, 4 channels for RGBA or 3 for RGB
+    :param mode: 'RGBA' or 'RGB'
+    :param out_path:
+    :return:
+    """
+    height, width = arr.shape[:2]
+    Image.frombuffer(mode, (width, height), arr, 'raw', mode, 0, 1).save(out_path, compress_level=FAST_PNG_COMPRESSION)
+
+
+_worker = {}
+
+
+def _init_worker(inverted_light):
+    """
+    Pool initializer: keep the light in the worker so tasks only carry file paths.
+    :param inverted_light: float32 array of 255 - light color, or None for a plain negative
+    :return:
+    """
+    _worker['inverted_light'] = inverted_light
+
+
+def _process_chunk(tasks):
+    """
+    Run the negative (and optional light) over a run of frames inside a pool worker, decoding and encoding
+    PNGs on a small thread pool while this thread does the pixel work.
+    :param tasks: list of (frame path, output path)
+    :return: list of error messages, None for each frame written
+    """
+    inverted_light = _worker['inverted_light']
+    results = []
+    with ThreadPoolExecutor(max_workers=_READ_AHEAD + 2) as pool:
+        reads = deque(pool.submit(_load_frame, path) for path, _ in tasks[:_READ_AHEAD])
+        writes = deque()
+        for n, (frame_path, out_path) in enumerate(tasks):
+            future = reads.popleft()
+            if n + _READ_AHEAD < len(tasks):
+                reads.append(pool.submit(_load_frame, tasks[n + _READ_AHEAD][0]))
+            try:
+                arr = future.result()
+            except Exception as e:
+                results.append(f"Error reading frame '{frame_path}': {e}")
+                continue
+            _negative_inplace(arr)
+            mode = 'RGBA'
+            if inverted_light is not None:
+                arr = _light_array(arr, inverted_light)
+                mode = 'RGB'
+            writes.append((pool.submit(_save_frame, arr, mode, out_path), out_path))
+            while len(writes) > _WRITE_BEHIND or (writes and writes[0][0].done()):
+                results.append(finish_write(*writes.popleft()))
+        while writes:
+            results.append(finish_write(*writes.popleft()))
+    return results
+
+
+def _process_sequence(frame_paths, inverted_light, workdir, sequence_prefix):
+    """
+    Run the negative (and optional light) over a frame sequence, split into runs of frames across one
+    process per core.
+    :param frame_paths:
+    :param inverted_light: float32 array of 255 - light color, or None for a plain negative
+    :param workdir:
+    :param sequence_prefix:
+    :return:
+    """
+    tasks = [(path, os.path.join(workdir, f"{sequence_prefix}_{i:04}.png")) for i, path in enumerate(frame_paths)]
+    run_frame_pool(tasks, _process_chunk, _init_worker, (inverted_light,), "Created negative for frame")
+
+
+def _frame_to_rgba(frame):
+    """
+    Copy a BGR video frame into a writable RGBA array, the layout the negative and light work on.
+    :param frame: (H, W, 3) uint8 BGR frame
+    :return:
+    """
+    height, width = frame.shape[:2]
+    arr = np.empty((height, width, 4), dtype=np.uint8)
+    arr[:, :, :3] = frame[:, :, ::-1]
+    arr[:, :, 3] = 255
+    return arr
+
+
+def _negative_frames(frames, inverted_light):
+    """
+    Generator behind process_frames.
+    :param frames: iterable of BGR uint8 frames
+    :param inverted_light: float32 array of 255 - light color, or None for a plain negative
+    :return:
+    """
+    for i, frame in enumerate(frames):
+        if i % 30 == 0:
+            log(f"Creating negative for frame {i + 1}")
+        arr = _negative_inplace(_frame_to_rgba(frame))
+        if inverted_light is not None:
+            arr = _light_array(arr, inverted_light)
+        # Back to BGR for OpenCV; the alpha a plain negative leaves behind is dropped like imread drops it
+        yield np.ascontiguousarray(arr[:, :, 2::-1])
+
+
+def process_frames(frames, operation, color):
+    """
+    Run the negative (and optional light) over in-memory video frames instead of a PNG sequence.
+    :param frames: iterable of BGR uint8 frames, e.g. from videotoimage.read_frames
+    :param operation: 'negative' or 'negative-reimage'
+    :param color: light color for negative-reimage
+    :return: generator of processed BGR uint8 frames, or None if the color is invalid
+    """
+    inverted_light = None
+    if operation == 'negative-reimage':
+        try:
+            light_rgb = hex_to_rgb(color)
+        except ValueError as e:
+            log(f"Color Error: {e}")
+            return None
+        inverted_light = 255.0 - np.asarray(light_rgb, dtype=np.float32)
+    return _negative_frames(frames, inverted_light)
+
+
+def process(inputfile, outputfile, operation, color, workdir, sequence_prefix, fast_encode=False):
     """
 Process images or sequences to create negative images or apply light color.
     :param inputfile:
@@ -100,37 +308,30 @@ Process images or sequences to create negative images or apply light color.
     :param color:
     :param workdir:
     :param sequence_prefix:
+    :param fast_encode: write a single-image PNG output with minimal compression too
     :return:
     """
+    compress_level = FAST_PNG_COMPRESSION if fast_encode else DEFAULT_PNG_COMPRESSION
     if os.path.isdir(inputfile):
-        frame_paths = sorted(glob.glob(os.path.join(inputfile, f"{sequence_prefix}_*.png")))
+        frame_paths = get_sequence_files(inputfile, sequence_prefix)
         if not frame_paths:
             log(f"No frames found in {inputfile} for prefix {sequence_prefix}")
             return
         if operation == 'negative':
-            for i, frame_path in enumerate(frame_paths):
-                img = create_negative(frame_path)
-                if img:
-                    out_path = os.path.join(workdir, f"{sequence_prefix}_{i:04}.png")
-                    save_image(img, out_path)
+            _process_sequence(frame_paths, None, workdir, sequence_prefix)
         elif operation == 'negative-reimage':
             try:
                 light_rgb = hex_to_rgb(color)
             except ValueError as e:
                 log(f"Color Error: {e}")
                 return
-            for i, frame_path in enumerate(frame_paths):
-                img = create_negative(frame_path)
-                if img:
-                    result = apply_light(img, light_rgb)
-                    if result:
-                        out_path = os.path.join(workdir, f"{sequence_prefix}_{i:04}.png")
-                        save_image(result, out_path)
+            inverted_light = 255.0 - np.asarray(light_rgb, dtype=np.float32)
+            _process_sequence(frame_paths, inverted_light, workdir, sequence_prefix)
     else:
         if operation == 'negative':
             img = create_negative(inputfile)
             if img:
-                save_image(img, outputfile)
+                save_image(img, outputfile, compress_level)
         elif operation == 'negative-reimage':
             img = create_negative(inputfile)
             if img:
@@ -141,4 +342,4 @@ Process images or sequences to create negative images or apply light color.
                     return
                 final_img = apply_light(img, light_rgb)
                 if final_img:
-                    save_image(final_img, outputfile)
\ No newline at end of file
+                    save_image(final_img, outputfile, compress_level)
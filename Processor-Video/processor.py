@@ -6,8 +6,8 @@ import sys
 
 
 from fileio import ensure_working_directory, cleanup_sequence
-from logger import log
-from videotoimage import extract_frames, frames_to_video
+from logger import log, log_error
+from videotoimage import extract_frames, frames_to_video, read_frames, frames_to_video_from_iter
 
 
 def define_args():
@@ -28,9 +28,20 @@ def define_args():
     parser.add_argument('--sequencename',
                         help='Optional label to append to generated sequence')
     parser.add_argument('--backgroundsequence', help='Background image or video or directory')
+    parser.add_argument('--tolerance', type=int, default=200,
+                        help='Max RGB distance from the chromakey color (default: 200, suits #00ff00 on a real green '
+                             'screen; use ~60 with a color sampled from the screen)')
     parser.add_argument('--cleanup', action='store_true',
-                        help='Delete image sequence files after processing')
-    return parser.parse_args()
+                        help='Delete image sequence files after processing (video to video negatives skip them entirely)')
+    parser.add_argument('--fast-encode', action='store_true',
+                        help='Use minimal PNG compression for image output as well (sequence frames always use it)')
+    parser.add_argument('--stride', type=int, default=1,
+                        help='Only process every Nth frame of video inputs, for quick previews or timelapses '
+                             '(the output is still encoded at 30 fps)')
+    args = parser.parse_args()
+    if args.stride < 1:
+        parser.error('--stride must be at least 1')
+    return args
 
 
 def is_video_file(path):
@@ -42,6 +53,34 @@ def is_video_file(path):
     return path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv', '.webm'))
 
 
+def can_stream(args):
+    """
+    Check if frames can go from the input video to the output video in memory. That skips the PNG
+    sequence entirely, so it's only done when the sequence would be cleaned up anyway.
+    :param args:
+    :return:
+    """
+    return (args.cleanup and args.operation in ['negative', 'negative-reimage']
+            and is_video_file(args.inputfile) and is_video_file(args.outputfile))
+
+
+def stream_video(args):
+    """
+    Decode, process and encode a video frame by frame without an intermediate image sequence.
+    :param args:
+    :return:
+    """
+    from negative import process_frames
+    log("Streaming frames from input video to output video...")
+    processed = process_frames(read_frames(args.inputfile, args.stride), args.operation, args.color)
+    if processed is None:
+        return False
+    if not frames_to_video_from_iter(processed, args.outputfile):
+        log_error("Failed to assemble output video.")
+        return False
+    return True
+
+
 def main():
     """
     Main function to process images or videos based on command-line arguments.
@@ -50,6 +89,10 @@ def main():
     args = define_args()
     timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M')
     sequence_prefix = f"{timestamp}_{args.sequencename}" if args.sequencename else timestamp
+    if can_stream(args):
+        log("Processing begins")
+        stream_video(args)
+        return
     ensure_working_directory(args.workingdirectory)
     log("Processing begins")
     input_sequence_dir = args.inputfile
@@ -59,16 +102,17 @@ def main():
         input_sequence_dir = os.path.join(args.workingdirectory, "inputframes")
         ensure_working_directory(input_sequence_dir)
         log("Extracting frames from input video...")
-        if not extract_frames(args.inputfile, input_sequence_dir, output_sequence_prefix):
-            log("Failed to extract frames from input video.")
+        if not extract_frames(args.inputfile, input_sequence_dir, output_sequence_prefix, args.stride):
+            log_error("Failed to extract frames from input video.")
             return
     background_sequence_dir = args.backgroundsequence
     if args.backgroundsequence and is_video_file(args.backgroundsequence):
         background_sequence_dir = os.path.join(args.workingdirectory, "backgroundframes")
         ensure_working_directory(background_sequence_dir)
         log("Extracting frames from background video...")
-        if not extract_frames(args.backgroundsequence, background_sequence_dir, output_sequence_prefix):
-            log("Failed to extract frames from background video.")
+        if not extract_frames(args.backgroundsequence, background_sequence_dir, output_sequence_prefix,
+                              args.stride):
+            log_error("Failed to extract frames from background video.")
             return
     if args.operation in ['negative', 'negative-reimage']:
         from negative import process as negative_process
@@ -78,7 +122,8 @@ def main():
             operation=args.operation,
             color=args.color,
             workdir=args.workingdirectory,
-            sequence_prefix=output_sequence_prefix
+            sequence_prefix=output_sequence_prefix,
+            fast_encode=args.fast_encode
         )
     elif args.operation == 'chromakey':
         from chromakey import process as chroma_process
@@ -88,12 +133,14 @@ def main():
             keycolor=args.color,
             workdir=args.workingdirectory,
             sequence_prefix=output_sequence_prefix,
-            background_sequence=background_sequence_dir
+            tolerance=args.tolerance,
+            background_sequence=background_sequence_dir,
+            fast_encode=args.fast_encode
         )
     if is_video_file(args.outputfile):
         log("Reassembling frames into output video...")
         if not frames_to_video(args.workingdirectory, output_sequence_prefix, args.outputfile):
-            log("Failed to assemble output video.")
+            log_error("Failed to assemble output video.")
             return
     if args.cleanup:
         cleanup_sequence(args.workingdirectory, output_sequence_prefix)
@@ -1,38 +1,185 @@
 # videotoimage.py
 import cv2
 import os
-import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fileio import get_sequence_files, FAST_PNG_COMPRESSION
+from logger import log, log_error
 
-def extract_frames(video_path, output_dir, prefix):
+# Strides at least this long seek to each sampled frame. Shorter ones decode straight through and just skip
+# frames, since every seek decodes forward from the previous keyframe anyway
+_SEEK_MIN_STRIDE = 30
+# PNG encodes extract_frames lets queue up behind the decoder
+_WRITE_BEHIND = 8
+
+def _open_capture(video_path):
+    """
+    Open a video for decoding with FFmpeg's frame threads spread over every core.
+    :param video_path:
+    :return: cv2.VideoCapture
+    """
+    threads = os.cpu_count() or 1
+    os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", f"threads;{threads}")
+    if hasattr(cv2, "CAP_PROP_N_THREADS"):
+        # Only honoured at open time; cap.set() on an already open capture is ignored
+        return cv2.VideoCapture(video_path, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, threads])
+    return cv2.VideoCapture(video_path)
+
+def _can_seek_frames(cap):
+    """
+    Check that seeking by frame index lands where asked. OpenCV turns the index into a timestamp using the
+    nominal frame rate, so on variable frame rate sources a seek ends up on a different frame (while still
+    reporting the requested position); the decoded frame's timestamp gives it away.
+    :param cap: open capture, left rewound to the first frame
+    :return:
+    """
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if total <= 0 or fps <= 0:
+        return False
+    probe = total // 2
+    cap.set(cv2.CAP_PROP_POS_FRAMES, probe)
+    exact = cap.grab() and abs(cap.get(cv2.CAP_PROP_POS_MSEC) - probe * 1000.0 / fps) < 500.0 / fps
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    return exact
+
+def _sampled_frames(cap, stride=1):
+    """
+    Yield every stride-th frame of an open capture, seeking for long strides on constant frame rate sources
+    and decoding straight through (grab() without color conversion for skipped frames) otherwise.
+    :param cap:
+    :param stride:
+    :return:
+    """
+    if stride >= _SEEK_MIN_STRIDE and _can_seek_frames(cap):
+        for i in range(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), stride):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame
+        return
+    i = 0
+    while True:
+        if i % stride:
+            if not cap.grab():
+                return
+        else:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame
+        i += 1
+
+def _finish_write(frame_index, future):
+    """
+    Wait for a queued frame encode.
+    :param frame_index:
+    :param future:
+    :return: True if the frame was written
+    """
+    try:
+        if future.result():
+            return True
+    except cv2.error:
+        pass
+    log_error(f"Error: Failed to write frame {frame_index}")
+    return False
+
+def extract_frames(video_path, output_dir, prefix, stride=1):
     """
     Extract frames from a video file and save them as images in the specified directory.
     :param video_path:
     :param output_dir:
     :param prefix:
+    :param stride: keep every stride-th frame only (1 keeps all of them)
     :return:
     """
+    if stride < 1:
+        log_error(f"Error: Frame stride must be at least 1, got {stride}")
+        return False
     if not os.path.exists(video_path):
-        print(f"Error: Video not found: {video_path}")
+        log_error(f"Error: Video not found: {video_path}")
         return False
-    cap = cv2.VideoCapture(video_path)
+    cap = _open_capture(video_path)
     if not cap.isOpened():
-        print(f"Error: Cannot open video: {video_path}")
+        log_error(f"Error: Cannot open video: {video_path}")
         return False
     os.makedirs(output_dir, exist_ok=True)
-    frame_index = 0
     success = True
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        filename = os.path.join(output_dir, f"{prefix}_{frame_index:04}.png")
-        if not cv2.imwrite(filename, frame):
-            print(f"Error: Failed to write frame {frame_index}")
-            success = False
-        frame_index += 1
+    params = [cv2.IMWRITE_PNG_COMPRESSION, FAST_PNG_COMPRESSION]
+    # imwrite releases the GIL, so frames are encoded on a few threads while the next ones are decoded
+    with ThreadPoolExecutor(max_workers=max(2, (os.cpu_count() or 1) // 2)) as pool:
+        writes = deque()
+        for frame_index, frame in enumerate(_sampled_frames(cap, stride)):
+            filename = os.path.join(output_dir, f"{prefix}_{frame_index:04}.png")
+            writes.append((frame_index, pool.submit(cv2.imwrite, filename, frame, params)))
+            while len(writes) > _WRITE_BEHIND or (writes and writes[0][1].done()):
+                success = _finish_write(*writes.popleft()) and success
+        while writes:
+            success = _finish_write(*writes.popleft()) and success
     cap.release()
     return success
 
+def read_frames(video_path, stride=1):
+    """
+    Decode a video frame by frame without writing anything to disk.
+    :param video_path:
+    :param stride: yield every stride-th frame only (1 yields all of them)
+    :return: generator of BGR uint8 frames
+    """
+    if stride < 1:
+        log_error(f"Error: Frame stride must be at least 1, got {stride}")
+        return
+    if not os.path.exists(video_path):
+        log_error(f"Error: Video not found: {video_path}")
+        return
+    cap = _open_capture(video_path)
+    if not cap.isOpened():
+        log_error(f"Error: Cannot open video: {video_path}")
+        return
+    try:
+        yield from _sampled_frames(cap, stride)
+    finally:
+        cap.release()
+
+def frames_to_video_from_iter(frames, output_path, fps=30):
+    """
+    Encode in-memory frames into a video file. The writer is created from the first frame's size.
+    :param frames: iterable of BGR uint8 frames
+    :param output_path:
+    :param fps:
+    :return:
+    """
+    out = None
+    try:
+        for frame in frames:
+            if out is None:
+                height, width = frame.shape[:2]
+                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+            out.write(frame)
+    finally:
+        if out is not None:
+            out.release()
+    if out is None:
+        log_error("Error: No frames to write")
+        return False
+    return True
+
+def _read_images(images):
+    """
+    Read image files as frames, skipping any that can't be decoded.
+    :param images:
+    :return:
+    """
+    for img_path in images:
+        frame = cv2.imread(img_path)
+        if frame is None:
+            log(f"Warning: Skipping unreadable frame {img_path}")
+            continue
+        yield frame
+
 def frames_to_video(input_dir, prefix, output_path, fps=30):
     """
     Convert a sequence of images into a video file.
@@ -42,20 +189,8 @@ def frames_to_video(input_dir, prefix, output_path, fps=30):
     :param fps:
     :return:
     """
-    pattern = os.path.join(input_dir, f"{prefix}_*.png")
-    images = sorted(glob.glob(pattern))
+    images = get_sequence_files(input_dir, prefix)
     if not images:
-        print(f"Error: No images found with prefix {prefix}")
+        log_error(f"Error: No images found with prefix {prefix}")
         return False
-    first_frame = cv2.imread(images[0])
-    height, width, layers = first_frame.shape
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-    for img_path in images:
-        frame = cv2.imread(img_path)
-        if frame is None:
-            print(f"Warning: Skipping unreadable frame {img_path}")
-            continue
-        out.write(frame)
-    out.release()
-    return True
+    return frames_to_video_from_iter(_read_images(images), output_path, fps)
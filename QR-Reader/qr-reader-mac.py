@@ -4,33 +4,45 @@ from tkinter import simpledialog
 from PIL import Image, ImageTk
 from pyzbar.pyzbar import decode
 import qrcode
+import functools
 import io
+import os
 import subprocess
 from AppKit import NSPasteboard, NSPasteboardTypePNG, NSImage
 from Foundation import NSData
 
 
+@functools.lru_cache(maxsize=64)
 def generate_qr_image(data):
     """
     Generates QR Image
     :param data:
-    :return:
+    :return: PIL image
     """
     qr = qrcode.QRCode(border=2, box_size=8)
     qr.add_data(data)
     qr.make(fit=True)
     img = qr.make_image(fill_color="black", back_color="white")
-    return img
+    # Cached per input, so hand out the PIL image itself; nothing draws on it after this
+    return img.get_image()
 
-def copy_png_mac(img):
+def png_bytes(img):
     """
-    Copies the QR image to the clipboard
+    Serializes the QR image as PNG for the clipboard
     :param img:
     :return:
     """
     output = io.BytesIO()
     img.save(output, format="PNG")
-    png_data = output.getvalue()
+    return output.getvalue()
+
+
+def copy_png_mac(png_data):
+    """
+    Copies the QR image to the clipboard
+    :param png_data: PNG bytes from png_bytes
+    :return:
+    """
     pb = NSPasteboard.generalPasteboard()
     pb.clearContents()
     data = NSData.dataWithBytes_length_(png_data, len(png_data))
@@ -38,79 +50,106 @@ def copy_png_mac(img):
     pb.writeObjects_([image])
 
 
-def show_generated_qr(img):
+def return_to_menu(win, root):
+    """
+    Makes closing the window bring the mode selection back instead of ending the program.
+    :param win:
+    :param root:
+    :return: the close handler, for extra key bindings
+    """
+    def close(event=None):
+        win.destroy()
+        root.deiconify()
+    win.protocol("WM_DELETE_WINDOW", close)
+    return close
+
+
+def show_generated_qr(img, root):
     """
     Shows the generated QR code
-    :param img:
+    :param img: PIL image from generate_qr_image
+    :param root: the program's Tk root
     :return:
     """
-    win = tk.Tk()
+    win = tk.Toplevel(root)
     win.title("Generated QR Code")
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    pil_img = Image.open(buffer)
-    tk_img = ImageTk.PhotoImage(pil_img, master=win)
+    tk_img = ImageTk.PhotoImage(img, master=win)
     label = tk.Label(win, image=tk_img)
     label.image = tk_img
     label.pack()
+    png_data = None
     def on_copy():
-        copy_png_mac(pil_img)
+        nonlocal png_data
+        if png_data is None:  # only encode when actually copied, and only once
+            png_data = png_bytes(img)
+        copy_png_mac(png_data)
     btn = tk.Button(win, text="Copy Image to Clipboard", command=on_copy)
     btn.pack(pady=10)
-    win.mainloop()
+    return_to_menu(win, root)
 
 
-def generate_qr():
+def generate_qr(root):
     """
     Generates QR code
+    :param root: the program's Tk root
     :return:
     """
-    root = tk.Tk()
-    root.withdraw()
     text = simpledialog.askstring("Enter Text", "Text or URL to encode:\n(Must include http/https for links)", parent=root)
-    root.destroy()
     if text:
         img = generate_qr_image(text)
-        show_generated_qr(img)
+        show_generated_qr(img, root)
+    else:
+        root.deiconify()
 
 
-def capture_and_decode_qr():
+def capture_and_decode_qr(root):
     """
     Obtains QR code and decodes it
+    :param root: the program's Tk root
     :return:
     """
     tmpfile = "/tmp/qr_snap.png"
-    subprocess.run(["screencapture", "-i", "-x", tmpfile])
     try:
-        img = Image.open(tmpfile)
+        os.remove(tmpfile)  # otherwise a canceled capture would decode the previous snapshot again
     except FileNotFoundError:
-        return  # User canceled
-    result = decode(img)
-    text = ""
-    if result:
-        for obj in result:
-            text += obj.data.decode('utf-8') + "\n"
-    else:
-        text = "No QR code found."
-    show_text_window(text)
+        pass
+    shown = False
+    try:
+        subprocess.run(["screencapture", "-i", "-x", tmpfile])
+        try:
+            with Image.open(tmpfile) as img:
+                gray = img.convert('L')  # zbar scans 8-bit luma only
+        except FileNotFoundError:
+            return  # User canceled
+        result = decode((gray.tobytes(), gray.width, gray.height))
+        text = ""
+        if result:
+            for obj in result:
+                text += obj.data.decode('utf-8') + "\n"
+        else:
+            text = "No QR code found."
+        show_text_window(text, root)
+        shown = True
+    finally:
+        if not shown:
+            root.deiconify()  # canceled or failed, so bring the mode selection back
 
 
-def show_text_window(text):
+def show_text_window(text, root):
     """
     Shows the text window
     :param text:
+    :param root: the program's Tk root
     :return:
     """
-    win = tk.Tk()
+    win = tk.Toplevel(root)
     win.title("Decoded QR Text")
     win.geometry("400x200")
     textbox = tk.Text(win, wrap='word')
     textbox.insert(tk.END, text.strip())
     textbox.pack(expand=True, fill='both')
     textbox.focus_set()
-    textbox.bind("<Escape>", lambda e: win.destroy())
-    win.mainloop()
+    textbox.bind("<Escape>", return_to_menu(win, root))
 
 
 def ask_mode_and_dispatch():
@@ -119,24 +158,26 @@ def ask_mode_and_dispatch():
     :return:
     """
     def choose(mode_choice):
-        win.destroy()
+        root.withdraw()
+        root.update()  # actually off screen before anything gets captured
         if mode_choice == "capture":
-            capture_and_decode_qr()
+            capture_and_decode_qr(root)
         elif mode_choice == "generate":
-            generate_qr()
-    win = tk.Tk()
-    win.title("QR Tool - Select Mode")
-    win.geometry("300x120")
-    win.resizable(False, False)
-    label = tk.Label(win, text="Choose an action:", font=("Arial", 12))
+            generate_qr(root)
+    # The one Tk root for the whole program; every other window is a Toplevel of it
+    root = tk.Tk()
+    root.title("QR Tool - Select Mode")
+    root.geometry("300x120")
+    root.resizable(False, False)
+    label = tk.Label(root, text="Choose an action:", font=("Arial", 12))
     label.pack(pady=10)
-    btn_frame = tk.Frame(win)
+    btn_frame = tk.Frame(root)
     btn_frame.pack(pady=5)
     capture_btn = tk.Button(btn_frame, text="Capture QR from Screen", width=25, command=lambda: choose("capture"))
     capture_btn.grid(row=0, column=0, padx=5)
     generate_btn = tk.Button(btn_frame, text="Generate QR from Text", width=25, command=lambda: choose("generate"))
     generate_btn.grid(row=1, column=0, padx=5, pady=5)
-    win.mainloop()
+    root.mainloop()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,10 @@
 # qr_tool.py
 import tkinter as tk
 from tkinter import simpledialog
-from PIL import ImageGrab, ImageTk, Image
+from PIL import ImageGrab, ImageTk
 from pyzbar.pyzbar import decode
 import qrcode
+import functools
 import io
 import win32clipboard
 import win32con
@@ -15,41 +16,45 @@ def ask_mode_and_dispatch():
     :return:
     """
     def choose(mode_choice):
-        win.destroy()
+        root.withdraw()
+        root.update()  # actually off screen before anything gets captured
         if mode_choice == "capture":
-            ScreenSnip()
+            ScreenSnip(root)
         elif mode_choice == "generate":
-            generate_qr()
-    win = tk.Tk()
-    win.title("QR Tool - Select Mode")
-    win.geometry("300x120")
-    win.resizable(False, False)
-    label = tk.Label(win, text="Choose an action:", font=("Arial", 12))
+            generate_qr(root)
+    # The one Tk root for the whole program; every other window is a Toplevel of it
+    root = tk.Tk()
+    root.title("QR Tool - Select Mode")
+    root.geometry("300x120")
+    root.resizable(False, False)
+    label = tk.Label(root, text="Choose an action:", font=("Arial", 12))
     label.pack(pady=10)
-    btn_frame = tk.Frame(win)
+    btn_frame = tk.Frame(root)
     btn_frame.pack(pady=5)
     capture_btn = tk.Button(btn_frame, text="Capture QR from Screen", width=25, command=lambda: choose("capture"))
     capture_btn.grid(row=0, column=0, padx=5)
     generate_btn = tk.Button(btn_frame, text="Generate QR from Text", width=25, command=lambda: choose("generate"))
     generate_btn.grid(row=1, column=0, padx=5, pady=5)
-    win.mainloop()
+    root.mainloop()
 
 
+@functools.lru_cache(maxsize=64)
 def generate_qr_image(data):
     """
     Generates a QR code image from the given data.
     :param data:
-    :return:
+    :return: PIL image
     """
     qr = qrcode.QRCode(border=2, box_size=8)
     qr.add_data(data)
     qr.make(fit=True)
     img = qr.make_image(fill_color="black", back_color="white")
-    return img
+    # Cached per input, so hand out the PIL image itself; nothing draws on it after this
+    return img.get_image()
 
-def copy_png(img):
+def dib_bytes(img):
     """
-    Copies the given image to the clipboard in PNG format.
+    Serializes the given image as a device-independent bitmap for the clipboard.
     :param img:
     :return:
     """
@@ -57,52 +62,77 @@ def copy_png(img):
     img.convert('RGB').save(output, 'BMP')
     data = output.getvalue()[14:]  # Strip BMP header
     output.close()
+    return data
+
+
+def copy_png(data):
+    """
+    Copies the given image to the clipboard.
+    :param data: DIB bytes from dib_bytes
+    :return:
+    """
     win32clipboard.OpenClipboard()
     win32clipboard.EmptyClipboard()
     win32clipboard.SetClipboardData(win32con.CF_DIB, data)
     win32clipboard.CloseClipboard()
 
 
-def show_generated_qr(img):
+def return_to_menu(win, root):
+    """
+    Makes closing the window bring the mode selection back instead of ending the program.
+    :param win:
+    :param root:
+    :return: the close handler, for extra key bindings
+    """
+    def close(event=None):
+        win.destroy()
+        root.deiconify()
+    win.protocol("WM_DELETE_WINDOW", close)
+    return close
+
+
+def show_generated_qr(img, root):
     """
     Displays the generated QR code image in a new window and provides an option to copy it to the clipboard.
-    :param img:
+    :param img: PIL image from generate_qr_image
+    :param root: the program's Tk root
     :return:
     """
-    win = tk.Tk()
+    win = tk.Toplevel(root)
     win.title("Generated QR Code")
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    pil_img = Image.open(buffer)
-    tk_img = ImageTk.PhotoImage(pil_img, master=win)
+    tk_img = ImageTk.PhotoImage(img, master=win)
     label = tk.Label(win, image=tk_img)
     label.image = tk_img
     label.pack()
+    dib_data = None
     def on_copy():
-        copy_png(pil_img)
+        nonlocal dib_data
+        if dib_data is None:  # only encode when actually copied, and only once
+            dib_data = dib_bytes(img)
+        copy_png(dib_data)
     btn = tk.Button(win, text="Copy Image to Clipboard", command=on_copy)
     btn.pack(pady=10)
-    win.mainloop()
+    return_to_menu(win, root)
 
 
-def generate_qr():
+def generate_qr(root):
     """
     Prompts the user for text or URL to generate a QR code.
+    :param root: the program's Tk root
     :return:
     """
-    root = tk.Tk()
-    root.withdraw()
     text = simpledialog.askstring("Enter Text", "Text or URL to encode:\n(Must include http/https for links)", parent=root)
-    root.destroy()
     if text:
         img = generate_qr_image(text)
-        show_generated_qr(img)
+        show_generated_qr(img, root)
+    else:
+        root.deiconify()
 
 
 class ScreenSnip:
-    def __init__(self):
-        self.root = tk.Tk()
+    def __init__(self, root):
+        self.parent = root
+        self.root = tk.Toplevel(root)
         self.root.attributes("-fullscreen", True)
         self.root.attributes("-alpha", 0.3)
         self.root.configure(bg='black')
@@ -112,7 +142,19 @@ class ScreenSnip:
         self.canvas.bind("<ButtonPress-1>", self.on_click)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_release)
-        self.root.mainloop()
+        # Closing the overlay or pressing Escape cancels the snip and brings the mode selection back
+        self.root.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.root.bind("<Escape>", self.cancel)
+        self.root.focus_force()
+
+    def cancel(self, event=None):
+        """
+        Closes the overlay without capturing and shows the mode selection again.
+        :param event:
+        :return:
+        """
+        self.root.destroy()
+        self.parent.deiconify()
 
     def on_click(self, event):
         """
@@ -142,7 +184,11 @@ class ScreenSnip:
         """
         x1, y1 = self.start_x, self.start_y
         x2, y2 = event.x, event.y
+        if x1 is None or x1 == x2 or y1 == y2:
+            self.cancel()  # a click without a drag selects nothing to grab
+            return
         self.root.destroy()
+        self.parent.update()  # let the overlay disappear before grabbing the screen
         self.capture(min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1))
 
 
@@ -155,8 +201,14 @@ class ScreenSnip:
         :param h:
         :return:
         """
-        img = ImageGrab.grab(bbox=(x, y, x + w, y + h))
-        self.decode_qr(img)
+        shown = False
+        try:
+            img = ImageGrab.grab(bbox=(x, y, x + w, y + h))
+            self.decode_qr(img)
+            shown = True
+        finally:
+            if not shown:
+                self.parent.deiconify()  # otherwise a failed grab or decode leaves no window at all
 
 
     def decode_qr(self, image):
@@ -165,7 +217,8 @@ class ScreenSnip:
         :param image:
         :return:
         """
-        result = decode(image)
+        gray = image.convert('L')  # zbar scans 8-bit luma only
+        result = decode((gray.tobytes(), gray.width, gray.height))
         text = ""
         if result:
             for obj in result:
@@ -181,15 +234,14 @@ class ScreenSnip:
         :param text:
         :return:
         """
-        win = tk.Tk()
+        win = tk.Toplevel(self.parent)
         win.title("Decoded QR Text")
         win.geometry("400x200")
         textbox = tk.Text(win, wrap='word')
         textbox.insert(tk.END, text.strip())
         textbox.pack(expand=True, fill='both')
         textbox.focus_set()
-        textbox.bind("<Escape>", lambda e: win.destroy())
-        win.mainloop()
+        textbox.bind("<Escape>", return_to_menu(win, self.parent))
 
 
 if __name__ == "__main__":
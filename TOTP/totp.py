@@ -2,8 +2,9 @@ import argparse
 import pyotp
 import qrcode
 import base64
-import hashlib
+import functools
 import hmac
+import struct
 import time
 
 
@@ -28,6 +29,41 @@ def generate_secret():
     qr.print_ascii()
 
 
+@functools.lru_cache(maxsize=32)
+def _decoded(secret):
+    """
+    Decode a base32 shared secret, once per secret.
+    :param secret: full string of initial secret
+    :return: key bytes
+    """
+    return base64.b32decode(secret, True)
+
+
+def _truncated(key, now):
+    """
+    HMAC the 30 second interval containing now and dynamically truncate the hash.
+    :param key: shared secret as raw bytes
+    :param now: Unix time in whole seconds
+    :return: (raw HMAC hash, truncation offset, truncated 31-bit int)
+    """
+    msg = struct.pack('>Q', now // 30)  # 30 second intervals - same as Google Authenticator
+    h = hmac.digest(key, msg, 'sha1')  # one-shot C path; skips building an HMAC object
+    offset = h[19] & 0x0F
+    # Dynamic truncation: 4 bytes from the offset as a big-endian int, top bit cleared
+    binary = int.from_bytes(h[offset:offset + 4], 'big') & 0x7FFFFFFF
+    return h, offset, binary
+
+
+def totp_at(key, now):
+    """
+    TOTP for an already decoded key at the given time.
+    :param key: shared secret as raw bytes
+    :param now: Unix time in whole seconds
+    :return: the six digit TOTP as an int
+    """
+    return _truncated(key, now)[2] % 1000000
+
+
 def show_totp(secret, verbose=False):
     """
     Show the current TOTP for the given shared secret.
@@ -35,21 +71,12 @@ def show_totp(secret, verbose=False):
     :param verbose: boolean if full process (hash, decimal, six digit truncation)
     :return:
     """
-    totp = pyotp.TOTP(secret)
+    key = _decoded(secret)
     now = int(time.time())
-    time_remaining = 30 - (now % 30)
-    interval = now // 30  # 30 second intervals - same as Google Authenticator
-    key = base64.b32decode(secret, True)
-    msg = interval.to_bytes(8, 'big')
-    h = hmac.new(key, msg, hashlib.sha1).digest()
-    offset = h[19] & 0x0F
-    binary = ((h[offset] & 0x7f) << 24 |
-              (h[offset + 1] & 0xff) << 16 |
-              (h[offset + 2] & 0xff) << 8 |
-              (h[offset + 3] & 0xff))
-    otp = binary % 1000000
-    print(f"TOTP: {otp:06d} (valid for {time_remaining}s)")
+    otp = totp_at(key, now)
+    print(f"TOTP: {otp:06d} (valid for {30 - (now % 30)}s)")
     if verbose:
+        h, offset, binary = _truncated(key, now)
         print(f"Raw HMAC hash (hex): {h.hex()}")
         print(f"Offset: {offset}")
         print(f"Truncated binary: {binary}")
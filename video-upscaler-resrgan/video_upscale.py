@@ -2,12 +2,17 @@
 
 import os
 import cv2
+import copy
+import functools
 import glob
 import shutil
 import argparse
 import subprocess
 import numpy as np
-import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from realesrgan import RealESRGANer
 from basicsr.archs.rrdbnet_arch import RRDBNet
@@ -26,36 +31,129 @@ import torch
 #             img /= 255.0  # normalize
 #         return super().enhance(img, outscale, alpha_upsampler)
 
+# Frames buffered between the reader, the upsampler and the writer in upscale_frames, and PNG encodes
+# queued behind the decoder in extract_frames
+PIPELINE_DEPTH = 8
+# Frames per forward pass on the GPU, and the share of the memory left free after warm-up that a batch may use.
+# Frames that don't fit go through the tiled enhance() one at a time instead
+UPSCALE_BATCH = 4
+BATCH_MEMORY_FRACTION = 0.5
+# Input pixels a batch may hold (measured when the upsampler warms up), and whether a batch ran out of memory,
+# which turns batching off for the rest of the run
+BATCH_STATE = {"max_pixels": 0, "oom": False}
+# Page-locked host buffers (two per direction, used alternately) and the upload stream for the batched path
+CUDA_STAGING = {}
+# Strides at least this long seek to each sampled frame. Shorter ones decode straight through and just skip
+# frames, since every seek decodes forward from the previous keyframe anyway
+SEEK_MIN_STRIDE = 30
+# Upscaled frames only feed the video encode, so they're kept as high quality JPEG, which encodes and decodes
+# far faster than PNG
+UPSCALED_EXT = ".jpg"
+UPSCALED_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 95]
+# INT8 calibration: frames sampled across the input, and the size of the center patch taken from each. The INT8
+# model is only used if it stays this close (PSNR in dB) to the float one on other patches of the same frames
+CALIBRATION_FRAMES = 8
+CALIBRATION_PATCH = 128
+INT8_MIN_PSNR = 35.0
 
-def extract_frames(input_video, orig_dir):
+
+def open_capture(video_path):
+    """
+    Open a video for decoding with FFmpeg's frame threads spread over every core.
+    :param video_path:
+    :return: cv2.VideoCapture
+    """
+    threads = os.cpu_count() or 1
+    os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", f"threads;{threads}")
+    if hasattr(cv2, "CAP_PROP_N_THREADS"):
+        # Only honoured at open time; cap.set() on an already open capture is ignored
+        return cv2.VideoCapture(video_path, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, threads])
+    return cv2.VideoCapture(video_path)
+
+
+def can_seek_frames(cap):
+    """
+    Check that seeking by frame index lands where asked. OpenCV turns the index into a timestamp using the
+    nominal frame rate, so on variable frame rate sources a seek ends up on a different frame (while still
+    reporting the requested position); the decoded frame's timestamp gives it away.
+    :param cap: open capture, left rewound to the first frame
+    :return:
+    """
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if total <= 0 or fps <= 0:
+        return False
+    probe = total // 2
+    cap.set(cv2.CAP_PROP_POS_FRAMES, probe)
+    exact = cap.grab() and abs(cap.get(cv2.CAP_PROP_POS_MSEC) - probe * 1000.0 / fps) < 500.0 / fps
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    return exact
+
+
+def sampled_frames(cap, stride=1):
+    """
+    Yield every stride-th frame of an open capture, seeking for long strides on constant frame rate sources
+    and decoding straight through (grab() without color conversion for skipped frames) otherwise.
+    :param cap:
+    :param stride:
+    :return:
+    """
+    if stride >= SEEK_MIN_STRIDE and can_seek_frames(cap):
+        for i in range(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), stride):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame
+        return
+    i = 0
+    while True:
+        if i % stride:
+            if not cap.grab():
+                return
+        else:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame
+        i += 1
+
+
+def extract_frames(input_video, orig_dir, stride=1):
     """
     Extract frames from a video file and save them as images.
     :param input_video:
     :param orig_dir:
-    :return:
+    :param stride: keep every stride-th frame only (1 keeps all of them)
+    :return: (fps of the extracted frames, frame count of the source)
     """
+    if stride < 1:
+        raise ValueError(f"Frame stride must be at least 1, got {stride}")
     os.makedirs(orig_dir, exist_ok=True)
-    cap = cv2.VideoCapture(input_video)
+    cap = open_capture(input_video)
     fps = cap.get(cv2.CAP_PROP_FPS)
     total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    for i in tqdm(range(total), desc="Extracting frames"):
-        ret, frame = cap.read()
-        if not ret:
-            break
-        cv2.imwrite(os.path.join(orig_dir, f"frame_{i:05d}.png"), frame)
+    frames = sampled_frames(cap, stride)
+    # imwrite releases the GIL, so frames are encoded on a few threads while the next ones are decoded
+    with ThreadPoolExecutor(max_workers=max(2, (os.cpu_count() or 1) // 2)) as pool:
+        pending = deque()
+        for i, frame in enumerate(tqdm(frames, total=-(-total // stride), desc="Extracting frames")):
+            path = os.path.join(orig_dir, f"frame_{i:05d}.png")
+            pending.append(pool.submit(cv2.imwrite, path, frame, [cv2.IMWRITE_PNG_COMPRESSION, 1]))
+            if len(pending) > PIPELINE_DEPTH:
+                pending.popleft().result()
+        for future in pending:
+            future.result()
     cap.release()
-    return fps, total
+    return fps / stride, total
 
 
-def upscale_frames(orig_dir, upscale_dir, model_path):
+def create_upsampler(model_path):
     """
-    Upscale images in a directory using Real-ESRGAN.
-    :param orig_dir:
-    :param upscale_dir:
+    Build the Real-ESRGAN x4plus upsampler, on the GPU in half precision when CUDA is available.
     :param model_path:
     :return:
     """
-    os.makedirs(upscale_dir, exist_ok=True)
     model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64,
                     num_block=23, num_grow_ch=32, scale=4)
     # use_cuda = torch.cuda.is_available()
@@ -73,27 +171,500 @@ def upscale_frames(orig_dir, upscale_dir, model_path):
     # print(f"[DEBUG] Device name: {torch.cuda.get_device_name(torch.cuda.current_device())}")
     # print(f"[DEBUG] GPU memory allocated: {torch.cuda.memory_allocated()} bytes")
     # print(f"[DEBUG] GPU memory reserved: {torch.cuda.memory_reserved()} bytes")
+    return upsampler
+
+
+@functools.lru_cache(maxsize=1)
+def get_upsampler(model_path):
+    """
+    Build the upsampler once per model and warm it up, so later videos reuse the loaded weights and the
+    first timed frame doesn't pay for CUDA/cuDNN initialization and algorithm selection.
+    :param model_path:
+    :return:
+    """
+    upsampler = create_upsampler(model_path)
+    if torch.device(upsampler.device).type == 'cuda':
+        # Frames (and tiles) repeat the same few shapes, so let cuDNN benchmark its algorithms once per shape
+        torch.backends.cudnn.benchmark = True
+        BATCH_STATE["max_pixels"] = measure_batch_budget(upsampler)
+    return upsampler
+
+
+def measure_batch_budget(upsampler, size=256):
+    """
+    Warm the model up on one size x size frame and use the peak memory of that pass to work out how many input
+    pixels an untiled batch can hold in BATCH_MEMORY_FRACTION of the memory still free on the card.
+    :param upsampler:
+    :param size:
+    :return: input pixels per batch
+    """
+    dtype = torch.float16 if upsampler.half else torch.float32
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    before = torch.cuda.memory_allocated()
+    with torch.no_grad():
+        upsampler.model(torch.zeros((1, 3, size, size), dtype=dtype, device=upsampler.device))
+    torch.cuda.synchronize()
+    per_pixel = max(1, torch.cuda.max_memory_allocated() - before) / (size * size)
+    torch.cuda.empty_cache()
+    free, _ = torch.cuda.mem_get_info()
+    max_pixels = int(free * BATCH_MEMORY_FRACTION / per_pixel)
+    print(f"[INFO] {per_pixel / 1024:.0f} KiB of GPU memory per input pixel, batches hold up to {max_pixels} pixels")
+    return max_pixels
+
+
+def frame_patches(frames, fy, fx, size=CALIBRATION_PATCH):
+    """
+    Cut a size x size patch centered at the same relative position out of every frame, as model input tensors.
+    :param frames: uint8 BGR frames
+    :param fy: vertical position of the patch center, 0 to 1
+    :param fx: horizontal position of the patch center, 0 to 1
+    :param size:
+    :return: list of (1, 3, H, W) RGB float tensors in [0, 1]
+    """
+    patches = []
+    for frame in frames:
+        top = min(max(0, int(frame.shape[0] * fy) - size // 2), max(0, frame.shape[0] - size))
+        left = min(max(0, int(frame.shape[1] * fx) - size // 2), max(0, frame.shape[1] - size))
+        patch = frame[top:top + size, left:left + size]
+        patches.append(to_tensor(cv2.cvtColor(patch, cv2.COLOR_BGR2RGB)).unsqueeze(0))
+    return patches
+
+
+def ssim(a, b):
+    """
+    Structural similarity of two uint8 RGB images, over their luma with the usual 11x11 Gaussian window.
+    :param a:
+    :param b:
+    :return:
+    """
+    a = cv2.cvtColor(a, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_a, mu_b = cv2.GaussianBlur(a, (11, 11), 1.5), cv2.GaussianBlur(b, (11, 11), 1.5)
+    var_a = cv2.GaussianBlur(a * a, (11, 11), 1.5) - mu_a * mu_a
+    var_b = cv2.GaussianBlur(b * b, (11, 11), 1.5) - mu_b * mu_b
+    cov = cv2.GaussianBlur(a * b, (11, 11), 1.5) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def quantize_upsampler(upsampler, frames):
+    """
+    Copy of the upsampler running a statically quantized INT8 model, calibrated on center patches of the given
+    frames and checked against the float model on patches from elsewhere in them. PyTorch only has INT8 conv
+    kernels for the CPU, so on CUDA (or if the INT8 output drifts too far) the upsampler is returned unchanged.
+    :param upsampler:
+    :param frames: list of uint8 BGR frames representative of the input
+    :return:
+    """
+    if torch.device(upsampler.device).type != 'cpu':
+        print("[INFO] INT8 inference is CPU only, keeping the FP16 model.")
+        return upsampler
+    if not frames:
+        print("[WARN] No frames to calibrate INT8 with, keeping the float model.")
+        return upsampler
+    # Only needed for --int8, and deprecated in newer PyTorch releases, so not imported up front
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+    patches = frame_patches(frames, 0.5, 0.5)
+    model = copy.deepcopy(upsampler.model).eval()
+    for module in model.modules():
+        if isinstance(module, torch.nn.LeakyReLU):
+            module.inplace = False  # the quantized op has no in-place form and warns on every call
+    qconfig = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(model, qconfig, example_inputs=(patches[0],))
+    with torch.no_grad():
+        for patch in tqdm(patches, desc="Calibrating INT8"):
+            prepared(patch)
+    int8_model = convert_fx(prepared)
+    psnrs, ssims = [], []
+    with torch.no_grad():
+        for patch in tqdm(frame_patches(frames, 0.25, 0.25) + frame_patches(frames, 0.75, 0.75),
+                          desc="Checking INT8"):
+            expected, actual = (out.squeeze(0).clamp_(0, 1).mul_(255.0).round_().byte().permute(1, 2, 0).numpy()
+                                for out in (upsampler.model(patch), int8_model(patch)))
+            psnrs.append(cv2.PSNR(expected, actual))
+            ssims.append(ssim(expected, actual))
+    psnr = float(np.mean(psnrs))
+    print(f"[INFO] INT8 vs float model on {len(psnrs)} held-out patches: PSNR {psnr:.2f} dB, "
+          f"SSIM {np.mean(ssims):.4f}")
+    if psnr < INT8_MIN_PSNR:
+        print(f"[WARN] INT8 output is below {INT8_MIN_PSNR} dB PSNR, keeping the float model.")
+        return upsampler
+    quantized = copy.copy(upsampler)
+    quantized.model = int8_model
+    return quantized
+
+
+def batch_size(upsampler, frame):
+    """
+    How many frames of this size start_batch runs at once, or 0 to use the tiled enhance() per frame
+    (on the CPU, for frames too large to run untiled, or once a batch has run out of memory).
+    :param upsampler:
+    :param frame:
+    :return:
+    """
+    if torch.device(upsampler.device).type != 'cuda' or BATCH_STATE["oom"]:
+        return 0
+    return min(UPSCALE_BATCH, BATCH_STATE["max_pixels"] // (frame.shape[0] * frame.shape[1]))
+
+
+def pinned_buffer(key, shape):
+    """
+    Page-locked uint8 host buffer for the batched path, allocated once per key and reused while the shape holds.
+    :param key:
+    :param shape:
+    :return:
+    """
+    buf = CUDA_STAGING.get(key)
+    if buf is None or tuple(buf.shape) != shape:
+        buf = torch.empty(shape, dtype=torch.uint8, pin_memory=True)
+        CUDA_STAGING[key] = buf
+    return buf
+
+
+@torch.no_grad()
+def start_batch(upsampler, frames, slot):
+    """
+    Queue the upload, forward pass and download of same-size frames without waiting for any of them. Frames are
+    staged in a pinned buffer and uploaded on a separate stream, so the upload can overlap the previous batch's
+    inference; the result matches an untiled enhance().
+    :param upsampler:
+    :param frames: list of (H, W, 3) uint8 BGR frames
+    :param slot: 0 or 1, which pair of pinned buffers to use; must differ from the batch still in flight
+    :return: (pinned host tensor receiving the NHWC BGR uint8 output, CUDA event marking it complete)
+    """
+    staging = pinned_buffer(("in", slot), (len(frames),) + frames[0].shape)
+    np.stack(frames, out=staging.numpy())
+    if "stream" not in CUDA_STAGING:
+        CUDA_STAGING["stream"] = torch.cuda.Stream()
+    upload = CUDA_STAGING["stream"]
+    with torch.cuda.stream(upload):
+        batch = staging.to(upsampler.device, non_blocking=True)
+    compute = torch.cuda.current_stream()
+    compute.wait_stream(upload)
+    batch.record_stream(compute)
+    # NHWC BGR uint8 -> NCHW RGB in [0, 1], cast straight to the model's dtype and scaled in place
+    dtype = torch.float16 if upsampler.half else torch.float32
+    batch = batch.permute(0, 3, 1, 2).flip(1).to(dtype).div_(255.0)
+    output = upsampler.model(batch)
+    output = output.float().clamp_(0, 1).mul_(255.0).round_().byte()
+    output = output.flip(1).permute(0, 2, 3, 1)
+    host_out = pinned_buffer(("out", slot), tuple(output.shape))
+    host_out.copy_(output, non_blocking=True)
+    done = torch.cuda.Event()
+    done.record(compute)
+    return host_out, done
+
+
+def finish_batch(upsampler, launched, outscale=1.5):
+    """
+    Wait for a batch queued by start_batch and resize its frames to the output scale.
+    :param upsampler:
+    :param launched: (host tensor, event) from start_batch
+    :param outscale:
+    :return: list of upscaled uint8 BGR frames
+    """
+    host_out, done = launched
+    done.synchronize()
+    output = host_out.numpy()
+    if outscale == upsampler.scale:
+        return [frame.copy() for frame in output]  # the pinned buffer is reused two batches on
+    height, width = output.shape[1] // upsampler.scale, output.shape[2] // upsampler.scale
+    size = (int(width * outscale), int(height * outscale))
+    return [cv2.resize(frame, size, interpolation=cv2.INTER_LANCZOS4) for frame in output]
+
+
+def frame_batches(upsampler, read_q):
+    """
+    Group frames from read_q into batches for the upsampler until the None sentinel. A batch is cut short
+    when the frame size changes.
+    :param upsampler:
+    :param read_q:
+    :return: generator of lists of (name, frame) tuples
+    """
+    batch = []
+    while True:
+        item = read_q.get()
+        if batch and (item is None or item[1].shape != batch[0][1].shape
+                      or len(batch) >= batch_size(upsampler, batch[0][1])):
+            yield batch
+            batch = []
+        if item is None:
+            return
+        batch.append(item)
+
+
+def put_outputs(write_q, batch, outputs):
+    """
+    Hand a batch's upscaled frames to the writer under their input names.
+    :param write_q:
+    :param batch: list of (name, frame) tuples
+    :param outputs:
+    :return:
+    """
+    for (fname, _), output in zip(batch, outputs):
+        write_q.put((fname, output))
+
+
+def upscale_queue(upsampler, read_q, write_q, total):
+    """
+    Upscale frames from read_q into write_q until the reader's None sentinel, then pass the sentinel on.
+    :param upsampler:
+    :param read_q: (name, uint8 BGR frame) tuples
+    :param write_q: (name, upscaled uint8 BGR frame) tuples
+    :param total: expected frame count, for the progress bar
+    :return:
+    """
+    with tqdm(total=total, desc="Upscaling frames") as progress:
+        pending = None  # (batch, start_batch result) still running on the GPU
+        slot = 0
+        for batch in frame_batches(upsampler, read_q):
+            frames = [img for _, img in batch]
+            launched = None
+            if batch_size(upsampler, frames[0]):
+                try:
+                    launched = start_batch(upsampler, frames, slot)
+                    slot ^= 1
+                except torch.cuda.OutOfMemoryError:
+                    # Every later batch would most likely fail the same way, so stop trying; this batch and the
+                    # rest go through the tiled path below
+                    print("[WARN] Out of GPU memory in a batch, upscaling tile by tile from here on.")
+                    BATCH_STATE["oom"] = True
+                    torch.cuda.empty_cache()
+            # Collect the previous batch only now, so its inference overlaps this one's staging and upload
+            if pending is not None:
+                put_outputs(write_q, pending[0], finish_batch(upsampler, pending[1]))
+                progress.update(len(pending[0]))
+                pending = None
+            if launched is not None:
+                pending = (batch, launched)
+                continue
+            outputs = [upsampler.enhance(img, outscale=1.5)[0] for img in frames]
+            put_outputs(write_q, batch, outputs)
+            progress.update(len(batch))
+        if pending is not None:
+            put_outputs(write_q, pending[0], finish_batch(upsampler, pending[1]))
+            progress.update(len(pending[0]))
+    write_q.put(None)
+
+
+def upscale_frames(orig_dir, upscale_dir, model_path, int8=False, output_file=None, fps=30):
+    """
+    Upscale images in a directory using Real-ESRGAN.
+    :param orig_dir:
+    :param upscale_dir:
+    :param model_path:
+    :param int8: run an INT8 model calibrated on a sample of the frames (CPU only)
+    :param output_file: also encode the upscaled frames to this video through an ffmpeg pipe as they're saved
+    :param fps:
+    :return: True if the encoder finished cleanly, or None without an output_file
+    """
+    os.makedirs(upscale_dir, exist_ok=True)
+    upsampler = get_upsampler(model_path)
     frame_files = sorted(f for f in os.listdir(orig_dir) if f.endswith(".png"))
-    for i, fname in enumerate(tqdm(frame_files, desc="Upscaling frames")):
-        img_path = os.path.join(orig_dir, fname)
-        img = cv2.imread(img_path, cv2.IMREAD_COLOR)
-        # Normalize to float32 in [0, 1] — but keep it NumPy
-        if img.dtype != np.float32:
-            img = img.astype(np.float32) / 255.0
-        start = time.time()
-        output, _ = upsampler.enhance(img, outscale=1.5)
-        end = time.time()
-        # Debug output
-        # print(f"[TIMING] Inference time: {end - start:.2f} sec")
-        # print(f"[DEBUG] Frame: {fname}")
-        # print(f"[DEBUG] Image dtype: {img.dtype}, shape: {img.shape}")
-        # print(f"[DEBUG] CUDA is available: {torch.cuda.is_available()}")
-        # print(f"[DEBUG] Current device: {torch.cuda.current_device()}")
-        # print(f"[DEBUG] Device name: {torch.cuda.get_device_name(torch.cuda.current_device())}")
-        # print(f"[DEBUG] Memory allocated: {torch.cuda.memory_allocated()} bytes")
-        # print(f"[DEBUG] Memory reserved: {torch.cuda.memory_reserved()} bytes")
-        # print(f"[DEBUG] Model is on device: {next(model.parameters()).device}")
-        cv2.imwrite(os.path.join(upscale_dir, fname), output)
+    if int8:
+        sample = frame_files[::max(1, len(frame_files) // CALIBRATION_FRAMES)][:CALIBRATION_FRAMES]
+        frames = (read_image(os.path.join(orig_dir, fname)) for fname in sample)
+        upsampler = quantize_upsampler(upsampler, [img for img in frames if img is not None])
+    # Decode and encode on their own threads so the GPU isn't waiting on PNGs; the upsampler stays on this one
+    read_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+    write_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+    reader = threading.Thread(target=read_frames, args=(orig_dir, frame_files, read_q), daemon=True)
+    video_q = None
+    result = {}
+    if output_file:
+        video_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+        encoder = threading.Thread(target=write_video_pipe, args=(output_file, fps, video_q, result), daemon=True)
+        encoder.start()
+    writer = threading.Thread(target=write_frames, args=(upscale_dir, write_q, video_q), daemon=True)
+    reader.start()
+    writer.start()
+    upscale_queue(upsampler, read_q, write_q, len(frame_files))
+    writer.join()
+    if output_file:
+        encoder.join()
+        return result.get("ok", False)
+
+
+def upscale_video(input_video, output_file, model_path, int8=False):
+    """
+    Upscale a video without intermediate images: ffmpeg decodes raw frames into the upsampler and
+    encodes its output straight from a pipe.
+    :param input_video:
+    :param output_file:
+    :param model_path:
+    :param int8: run an INT8 model calibrated on a sample of the video's frames (CPU only)
+    :return: True if the encoder finished cleanly
+    """
+    cap = cv2.VideoCapture(input_video)
+    if not cap.isOpened():
+        print(f"[ERROR] Cannot open video '{input_video}'.")
+        return False
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    upsampler = get_upsampler(model_path)
+    if int8:
+        frames = sampled_frames(cap, max(1, total // CALIBRATION_FRAMES))
+        upsampler = quantize_upsampler(upsampler, [frame for _, frame in zip(range(CALIBRATION_FRAMES), frames)])
+    cap.release()
+    read_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+    write_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+    result = {}
+    reader = threading.Thread(target=read_video_pipe, args=(input_video, width, height, read_q), daemon=True)
+    writer = threading.Thread(target=write_video_pipe, args=(output_file, fps, write_q, result), daemon=True)
+    reader.start()
+    writer.start()
+    upscale_queue(upsampler, read_q, write_q, total)
+    writer.join()
+    return result.get("ok", False)
+
+
+def read_image(path):
+    """
+    Read an image as 8-bit BGR: pull the file in with one np.fromfile and decode it IMREAD_UNCHANGED so
+    already-BGR frames skip the color conversion. Alpha is dropped; grayscale or 16-bit images are
+    decoded again with IMREAD_COLOR, which is what cv2.imread did.
+    :param path:
+    :return: the image, or None if it can't be read
+    """
+    try:
+        buf = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        return None
+    img = cv2.imdecode(buf, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    if img.dtype != np.uint8 or img.ndim != 3:
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if img.shape[2] == 4:
+        img = np.ascontiguousarray(img[:, :, :3])
+    return img
+
+
+def read_frames(orig_dir, frame_files, read_q):
+    """
+    Pipeline reader for upscale_frames: decode frames into the queue, then a None sentinel.
+    :param orig_dir:
+    :param frame_files:
+    :param read_q:
+    :return:
+    """
+    try:
+        for fname in frame_files:
+            img = read_image(os.path.join(orig_dir, fname))
+            if img is None:
+                print(f"Warning: Skipping unreadable frame {fname}")
+                continue
+            read_q.put((fname, img))
+    finally:
+        read_q.put(None)
+
+
+def read_video_pipe(input_video, width, height, read_q):
+    """
+    Pipeline reader for upscale_video: let ffmpeg decode to raw BGR and read each frame straight into
+    its own array (np.fromfile can't be used here, it seeks and pipes can't).
+    :param input_video:
+    :param width:
+    :param height:
+    :param read_q:
+    :return:
+    """
+    cmd = ["ffmpeg", "-v", "error", "-i", input_video, "-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+    proc = None
+    # The None sentinel has to reach the queue however this ends, or the upscaler and writer wait forever
+    try:
+        if width <= 0 or height <= 0:
+            print(f"[ERROR] Could not read the frame size of {input_video}.")
+            return
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        except OSError as e:
+            print(f"[ERROR] Could not start the ffmpeg decoder: {e}")
+            return
+        i = 0
+        while True:
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            if proc.stdout.readinto(memoryview(frame).cast("B")) < frame.nbytes:
+                break
+            read_q.put((f"frame_{i:05d}", frame))
+            i += 1
+    finally:
+        if proc is not None:
+            proc.stdout.close()
+            proc.wait()
+        read_q.put(None)
+
+
+def write_frames(upscale_dir, write_q, video_q=None):
+    """
+    Pipeline writer for upscale_frames: save upscaled frames from the queue until the None sentinel.
+    :param upscale_dir:
+    :param write_q:
+    :param video_q: optional queue each frame (and the sentinel) is passed on to after saving
+    :return:
+    """
+    while True:
+        item = write_q.get()
+        if video_q is not None:
+            video_q.put(item)
+        if item is None:
+            break
+        fname, output = item
+        path = os.path.join(upscale_dir, os.path.splitext(fname)[0] + UPSCALED_EXT)
+        if not cv2.imwrite(path, output, UPSCALED_PARAMS):
+            print(f"Warning: Failed to write frame {fname}")
+
+
+def write_video_pipe(output_file, fps, write_q, result):
+    """
+    Pipeline writer for upscale_video: feed upscaled frames to an ffmpeg libx264 encoder until the None
+    sentinel. The encoder is started on the first frame, once the output size is known.
+    :param output_file:
+    :param fps:
+    :param write_q:
+    :param result: dict that gets "ok" set to whether the encode succeeded
+    :return:
+    """
+    proc = None
+    failed = False
+    while True:
+        item = write_q.get()
+        if item is None:
+            break
+        if failed:
+            continue  # keep draining so the upscaler never blocks on a full queue
+        _, output = item
+        try:
+            if proc is None:
+                height, width = output.shape[:2]
+                cmd = [
+                    "ffmpeg", "-y", "-v", "error",
+                    "-f", "rawvideo", "-pix_fmt", "bgr24",
+                    "-s", f"{width}x{height}", "-r", str(fps),
+                    "-i", "-",
+                    "-c:v", "libx264",
+                    "-pix_fmt", "yuv420p",
+                    output_file
+                ]
+                proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+            proc.stdin.write(np.ascontiguousarray(output).data)
+        except OSError as e:
+            print(f"[ERROR] ffmpeg encoder stopped: {e}")
+            failed = True
+    if proc is None:
+        print("[ERROR] No frames to encode.")
+        result["ok"] = False
+        return
+    try:
+        proc.stdin.close()
+    except OSError:
+        pass
+    result["ok"] = proc.wait() == 0 and not failed
 
 
 def frames_to_video(input_dir, prefix, output_path, fps=30):
@@ -105,17 +676,17 @@ def frames_to_video(input_dir, prefix, output_path, fps=30):
     :param fps:
     :return:
     """
-    pattern = os.path.join(input_dir, f"{prefix}_*.png")
+    pattern = os.path.join(input_dir, f"{prefix}_*{UPSCALED_EXT}")
     images = sorted(glob.glob(pattern))
     if not images:
         print(f"Error: No images found with prefix {prefix}")
         return False
-    first_frame = cv2.imread(images[0])
+    first_frame = read_image(images[0])
     height, width, _ = first_frame.shape
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
     for img_path in images:
-        frame = cv2.imread(img_path)
+        frame = read_image(img_path)
         if frame is None:
             print(f"Warning: Skipping unreadable frame {img_path}")
             continue
@@ -135,7 +706,7 @@ def reassemble_video_alt(upscale_dir, output_file, fps):
     cmd = [
         "ffmpeg", "-y",
         "-framerate", str(fps),
-        "-i", os.path.join(upscale_dir, "frame_%05d.png"),
+        "-i", os.path.join(upscale_dir, f"frame_%05d{UPSCALED_EXT}"),
         "-c:v", "libx264",
         "-pix_fmt", "yuv420p",
         output_file
@@ -163,8 +734,16 @@ def parse_args():
     parser.add_argument("--inputfile", required=True, help="Input source video file")
     parser.add_argument("--outputfile", required=True, help="Output 1080p video file")
     parser.add_argument("--workdir", required=True, help="Temporary work directory")
-    parser.add_argument("--cleanup", action="store_true", help="Delete work directories after processing")
-    return parser.parse_args()
+    parser.add_argument("--cleanup", action="store_true",
+                        help="Delete work directories after processing (with ffmpeg on PATH, no frames are written)")
+    parser.add_argument("--int8", action="store_true",
+                        help="Run the model INT8-quantized, calibrated on frames of the input (CPU only)")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="Upscale only every Nth frame, at 1/N the frame rate (for quick previews)")
+    args = parser.parse_args()
+    if args.stride < 1:
+        parser.error("--stride must be at least 1")
+    return args
 
 
 def main():
@@ -176,12 +755,26 @@ def main():
     orig_dir = os.path.join(args.workdir, "origframes")
     upscale_dir = os.path.join(args.workdir, "upscaledframes")
     model_path = "Real-ESRGAN/weights/RealESRGAN_x4plus.pth"
+    if args.cleanup and args.stride == 1 and shutil.which("ffmpeg"):
+        # Frames wouldn't be kept anyway, so skip them: decode, upscale and encode through ffmpeg pipes
+        # (the pipe reader takes every frame, so strided runs go through extract_frames below)
+        print(">>> Upscaling video (ffmpeg pipes)...")
+        if not upscale_video(args.inputfile, args.outputfile, model_path, args.int8):
+            print("[FAIL] Video assembly failed.")
+            return
+        print(f"\nDONE. Upscaled video saved as: {args.outputfile}")
+        return
     print(">>> Step 1: Extracting frames...")
-    fps, total = extract_frames(args.inputfile, orig_dir)
-    print(">>> Step 2: Upscaling frames...")
-    upscale_frames(orig_dir, upscale_dir, model_path)
-    print(">>> Step 3: Reassembling video (OpenCV)...")
-    success = frames_to_video(upscale_dir, prefix="frame", output_path=args.outputfile, fps=fps)
+    fps, total = extract_frames(args.inputfile, orig_dir, args.stride)
+    if shutil.which("ffmpeg"):
+        # Encode the upscaled frames as they're saved instead of reading the PNGs back afterwards
+        print(">>> Step 2: Upscaling frames and encoding video (ffmpeg pipe)...")
+        success = upscale_frames(orig_dir, upscale_dir, model_path, args.int8, output_file=args.outputfile, fps=fps)
+    else:
+        print(">>> Step 2: Upscaling frames...")
+        upscale_frames(orig_dir, upscale_dir, model_path, args.int8)
+        print(">>> Step 3: Reassembling video (OpenCV)...")
+        success = frames_to_video(upscale_dir, prefix="frame", output_path=args.outputfile, fps=fps)
     if not success:
         print("[FAIL] Video assembly failed.")
         return